@@ -0,0 +1,6 @@
+"""
+Offline benchmarks for EWS and the vendored wxpy / itchat libraries.
+
+Each ``bench_*`` module is a standalone script, run from the repository root
+with ``python -m benchmarks.bench_<name> --help``.
+"""
@@ -0,0 +1,75 @@
+"""
+Memory held by contacts and group members stored in ``itchat``.
+
+Friends, official accounts and groups of a synthetic account are merged
+into a fresh ``Core`` the way they are after login: contacts first, with
+groups listed without members, then groups with their members as fetched
+by ``webwxbatchgetcontact``. Reported is the memory retained by each step,
+traced with ``tracemalloc``, per record stored.
+
+    python -m benchmarks.bench_contacts_memory --groups 200 --members 500
+"""
+import argparse
+import copy
+import gc
+import tracemalloc
+
+from efb_wechat_slave.vendor.itchat import Core
+from efb_wechat_slave.vendor.itchat.components.contact import update_local_chatrooms, update_local_friends
+from efb_wechat_slave.vendor.itchat.storage.templates import wrap_user_dict
+from efb_wechat_slave.vendor.itchat.utils import struct_friend_info
+
+from .fixtures import SELF_NICK_NAME, SELF_USER_NAME, SyntheticAccount
+
+
+def retained(fn, *args):
+    """Bytes still allocated after calling ``fn``, and its result."""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn(*args)
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--friends", type=int, default=5000)
+    parser.add_argument("--mps", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--members", type=int, default=500)
+    args = parser.parse_args()
+
+    account = SyntheticAccount(friends=args.friends, mps=args.mps,
+                               groups=args.groups, members=args.members)
+    core = Core()
+    core.loginInfo.update({"wxuin": "1234567890",
+                           "User": wrap_user_dict(struct_friend_info(account.self_contact))})
+    core.loginInfo["User"].core = core
+    core.storageClass.userName = SELF_USER_NAME
+    core.storageClass.nickName = SELF_NICK_NAME
+
+    # Inputs are built before tracing, only what is kept from them is counted
+    friends = copy.deepcopy(account.friends + account.mps)
+    groups = copy.deepcopy([dict(i, MemberList=[], MemberCount=0) for i in account.groups])
+    members = copy.deepcopy(account.groups)
+    member_count = sum(len(i["MemberList"]) for i in members)
+
+    tracemalloc.start()
+    friends_size, _ = retained(update_local_friends, core, friends)
+    groups_size, _ = retained(update_local_chatrooms, core, groups)
+    members_size, _ = retained(update_local_chatrooms, core, members)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("friends and MPs:   %8.1f KiB, %5.0f B each (%d)"
+          % (friends_size / 1024, friends_size / max(1, len(friends)), len(friends)))
+    print("groups:            %8.1f KiB, %5.0f B each (%d)"
+          % (groups_size / 1024, groups_size / max(1, len(groups)), len(groups)))
+    print("group members:     %8.1f KiB, %5.0f B each (%d)"
+          % (members_size / 1024, members_size / max(1, member_count), member_count))
+    print("total:             %8.1f KiB, peak %.1f KiB"
+          % ((friends_size + groups_size + members_size) / 1024, peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Convert stickers to GIF and JPEG as ``WeChatChannel.send_message`` does.
+
+Synthetic stickers of typical Telegram sizes (512 px static, 100 px
+thumbnails, and 512 px animations) are converted:
+
+* ``inline (before)``: the conversion formerly done in ``send_message``,
+  first frame only;
+* ``inline``: ``media_converter`` in the calling thread;
+* ``pool``: ``MediaConverter`` with worker processes.
+
+While converting, another thread wakes up every millisecond, and the
+longest delay of its wake-ups shows how long other threads of the channel
+are held up by the conversion.
+
+    python -m benchmarks.bench_convert --repeat 10 --workers 2
+"""
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from efb_wechat_slave.media_converter import MediaConverter
+
+SIZES = (("static 512px", 512, 1), ("static 100px", 100, 1), ("animated 512px x 30", 512, 30))
+
+
+def make_sticker(size, frames):
+    images = []
+    for i in range(frames):
+        img = Image.radial_gradient("L").resize((size, size)).convert("RGBA")
+        img.putalpha(Image.linear_gradient("L").resize((size, size)).rotate(i * 12))
+        images.append(img)
+    buffer = io.BytesIO()
+    if frames > 1:
+        images[0].save(buffer, format="WEBP", save_all=True, append_images=images[1:], duration=40)
+    else:
+        images[0].save(buffer, format="WEBP")
+    return buffer.getvalue()
+
+
+def legacy_convert(mime, data, path):
+    """Conversion as formerly done inline in ``WeChatChannel.send_message``."""
+    with open(path, "wb") as f:
+        if mime == "image/gif":
+            img = Image.open(io.BytesIO(data))
+            try:
+                alpha = img.split()[3]
+                mask = Image.eval(alpha, lambda a: 255 if a <= 128 else 0)
+            except IndexError:
+                mask = Image.eval(img.split()[0], lambda a: 0)
+            img = img.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=255)
+            img.paste(255, mask)
+            img.save(f, format="GIF", transparency=255)
+        else:
+            img = Image.open(io.BytesIO(data)).convert('RGBA')
+            out = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            out.paste(img, img)
+            out.convert('RGB').save(f, format="JPEG")
+        return f.tell()
+
+
+class StallProbe:
+    """Wake up every millisecond in another thread, and record the longest delay."""
+
+    INTERVAL = 0.001
+
+    def __init__(self):
+        self.max_stall = 0.0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.perf_counter()
+            time.sleep(self.INTERVAL)
+            self.max_stall = max(self.max_stall, time.perf_counter() - started - self.INTERVAL)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def measure(convert, mime, data, path, repeat):
+    timings = []
+    with StallProbe() as probe:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            convert(mime, data, path)
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings), probe.max_stall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    converter = MediaConverter(0)
+    pool = MediaConverter(args.workers)
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        # Start worker processes before measuring.
+        pool.convert("image/jpeg", make_sticker(16, 1), path)
+        print("%-22s %-11s %-16s %10s %12s" % ("sticker", "to", "method", "median", "max stall"))
+        for name, size, frames in SIZES:
+            data = make_sticker(size, frames)
+            for mime in ("image/gif", "image/jpeg"):
+                for method, convert in (("inline (before)", legacy_convert),
+                                        ("inline", converter.convert),
+                                        ("pool", pool.convert)):
+                    median, stall = measure(convert, mime, data, path, args.repeat)
+                    print("%-22s %-11s %-16s %7.1f ms %9.1f ms" % (
+                        name, mime, method, median * 1e3, stall * 1e3))
+    finally:
+        pool.stop()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
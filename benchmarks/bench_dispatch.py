@@ -0,0 +1,109 @@
+"""
+Measure dispatch overhead of ``wxpy.Registered.get_config``.
+
+A ``wxpy.Bot`` logs in to ``benchmarks.mock_server`` and registers the same
+handlers as ``WeChatChannel``, plus ``--except-self`` handlers that ignore
+messages sent by the bot itself. Messages produced from a synthetic (or
+recorded) corpus are then matched against the registrations, using the
+routing table of ``Registered`` and a linear scan over all registrations
+(as before the routing table) for comparison.
+
+    python -m benchmarks.bench_dispatch --messages 5000
+"""
+import argparse
+import copy
+import logging
+import statistics
+import time
+
+from efb_wechat_slave.vendor.itchat import config as itchat_config
+from efb_wechat_slave.vendor.itchat.components.messages import produce_msg
+
+from .fixtures import SyntheticAccount, load_corpus
+from .mock_server import MockWebWeChat
+
+# Message types registered by ``SlaveMessageManager.wechat_msg_register``
+EWS_MSG_TYPES = ("Text", "Sharing", "Picture", "Sticker", "Attachment", "Recording",
+                 "Map", "Video", "Card", "Friends", "Note", "Useless")
+
+
+def scan_config(registered, msg):
+    """Linear scan over all registrations, resolving the sender for ``except_self``."""
+    for conf in registered[::-1]:
+        if not conf.enabled or (conf.except_self and msg.sender == registered.bot.self):
+            continue
+        if conf.msg_types and msg.type not in conf.msg_types:
+            continue
+        elif conf.msg_types is None and msg.type == "System":
+            continue
+        if conf.chats is None:
+            return conf
+        for chat in conf.chats:
+            if (isinstance(chat, type) and isinstance(msg.chat, chat)) or chat == msg.chat:
+                return conf
+
+
+def time_dispatch(get_config, messages, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in messages:
+            get_config(msg)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000, help="Size of the synthetic corpus")
+    parser.add_argument("--corpus", help="Path to a recorded AddMsgList corpus in JSON")
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--except-self", type=int, default=1,
+                        help="Handlers registered with except_self=True")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    from efb_wechat_slave.vendor import wxpy
+    from efb_wechat_slave.vendor.wxpy.api.messages import Message
+
+    account = SyntheticAccount(friends=args.friends, groups=args.groups, members=args.members)
+    with MockWebWeChat(account) as server:
+        itchat_config.BASE_URL = server.url
+        bot = wxpy.Bot(qr_callback=lambda **_: None, login_callback=lambda: None,
+                       start_immediately=False)
+
+        def handler(msg):
+            pass
+
+        for _ in range(args.except_self):
+            bot.register(msg_types=("Text", "Picture"), except_self=True)(handler)
+        for msg_type in EWS_MSG_TYPES:
+            bot.register(msg_types=msg_type, except_self=False)(handler)
+
+        corpus = load_corpus(args.corpus) or account.make_messages(args.messages)
+        # Stay offline: members missing from a recorded corpus are not fetched.
+        bot.core.update_chatroom = lambda *_, **__: None
+        messages = [Message(raw, bot) for raw in produce_msg(bot.core, copy.deepcopy(corpus))]
+
+        routed = time_dispatch(bot.registered.get_config, messages, args.repeat)
+        scanned = time_dispatch(lambda msg: scan_config(bot.registered, msg), messages, args.repeat)
+        mismatches = sum(bot.registered.get_config(msg) is not scan_config(bot.registered, msg)
+                         for msg in messages)
+
+        bot.cleanup()
+        server.logout()
+
+    print("messages per run:  %d" % len(messages))
+    print("registrations:     %d" % len(bot.registered))
+    print("mismatches:        %d" % mismatches)
+    for name, timings in (("routing table", routed), ("linear scan", scanned)):
+        best = min(timings)
+        print("%-18s %.2f us/msg (median run %.1f ms)" % (
+            name + ":", best / len(messages) * 1e6, statistics.median(timings) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+End-to-end throughput of the channel against a mock Web WeChat server.
+
+A synthetic (or recorded) account is served by ``benchmarks.mock_server``,
+messages are injected in bursts, and the time from ingest by the server to
+the handler is measured for every message:
+
+* ``wxpy``: to a handler registered on ``wxpy.Bot``;
+* ``ews``: to ``send_message`` of a master channel, through ``WeChatChannel``
+  and ``coordinator.send_message``.
+
+Optionally, messages are also sent out to measure outbound throughput.
+Flags of ``WeChatChannel`` can be set with ``--flag``, e.g. to limit the rate
+of outbound messages:
+
+    python -m benchmarks.bench_e2e --target ews --messages 2000 --friends 1000 \
+        --send 200 --flag send_rate_limit=60 --flag send_chat_rate_limit=30
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from efb_wechat_slave.vendor.itchat import config as itchat_config
+
+from .fixtures import SyntheticAccount, load_corpus
+from .mock_server import MockWebWeChat
+
+
+class LatencyRecorder:
+    """Collect the time each message arrived at the end of the pipeline."""
+
+    def __init__(self, server: MockWebWeChat):
+        self.server = server
+        self.arrived_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.updated = threading.Event()
+
+    def record(self, msg_id: str):
+        now = time.perf_counter()
+        with self.lock:
+            self.arrived_at.setdefault(msg_id, now)
+        self.updated.set()
+
+    def wait(self, expected: int, idle: float) -> int:
+        """Wait until ``expected`` messages arrived, or nothing arrived for ``idle`` seconds."""
+        while len(self.arrived_at) < expected:
+            self.updated.clear()
+            if not self.updated.wait(idle):
+                break
+        return len(self.arrived_at)
+
+    def latencies(self) -> List[float]:
+        injected_at = self.server.injected_at
+        return [arrived - injected_at[msg_id] for msg_id, arrived in self.arrived_at.items()
+                if msg_id in injected_at]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def rss_mib() -> Dict[str, float]:
+    """Current and peak resident set size of this process."""
+    result = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss" if line.startswith("VmRSS") else "peak"
+                    result[key] = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS, KiB elsewhere.
+        result["peak"] = peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return result
+
+
+class WxpyTarget:
+    """Deliver messages to a handler registered on a bare ``wxpy.Bot``."""
+
+    def __init__(self, recorder: LatencyRecorder, data_path: str, flags: Dict[str, Any]):
+        from efb_wechat_slave.vendor import wxpy
+
+        self.bot = wxpy.Bot(qr_callback=lambda **_: None, login_callback=lambda: None,
+                            start_immediately=False)
+
+        @self.bot.register(except_self=False)
+        def on_message(msg):
+            recorder.record(str(msg.id))
+
+        self.bot.start()
+
+    def send(self, index: int):
+        self.bot.friends()[index % (len(self.bot.friends()) - 1) + 1].send_msg("Outbound %d" % index)
+
+    def stop(self):
+        self.bot.cleanup()
+
+
+class EWSTarget:
+    """Deliver messages to a master channel through ``WeChatChannel``."""
+
+    def __init__(self, recorder: LatencyRecorder, data_path: str, flags: Dict[str, Any]):
+        import yaml
+        from ehforwarderbot import coordinator
+        from ehforwarderbot import utils as efb_utils
+        from ehforwarderbot.channel import MasterChannel
+        from ehforwarderbot.types import ModuleID
+
+        from efb_wechat_slave import WeChatChannel
+
+        class BenchmarkMasterChannel(MasterChannel):
+            channel_name = "Benchmark master"
+            channel_emoji = "⏱"
+            channel_id = ModuleID("benchmarks.master")
+            supported_message_types = set()
+            __version__ = "0"
+
+            def send_message(self, msg):
+                recorder.record(json.loads(msg.uid)[0][0])
+                return msg
+
+            def send_status(self, status):
+                pass
+
+            def poll(self):
+                pass
+
+            def stop_polling(self):
+                pass
+
+            def get_message_by_id(self, chat, msg_id):
+                return None
+
+        os.environ["EFB_DATA_PATH"] = data_path
+        coordinator.profile = "benchmark"
+        if flags:
+            config_path = efb_utils.get_config_path(WeChatChannel.channel_id)
+            with config_path.open("w") as f:
+                yaml.dump({"flags": flags}, f)
+        coordinator.add_channel(BenchmarkMasterChannel())
+        # Keep the login QR code out of the report.
+        logging.disable(99)
+        try:
+            self.channel = WeChatChannel()
+        finally:
+            logging.disable(logging.NOTSET)
+        coordinator.add_channel(self.channel)
+        self.poll_thread = threading.Thread(target=self.channel.poll, name="EWS poll", daemon=True)
+        self.poll_thread.start()
+
+    def send(self, index: int):
+        friends = self.channel.bot.friends()
+        self.channel._bot_send_msg(friends[index % (len(friends) - 1) + 1], "Outbound %d" % index)
+
+    def stop(self):
+        self.channel.stop_polling()
+        self.poll_thread.join(5)
+
+
+TARGETS: Dict[str, Callable[[LatencyRecorder, str, Dict[str, Any]], object]] = {
+    "wxpy": WxpyTarget,
+    "ews": EWSTarget,
+}
+
+
+def parse_flag(value: str):
+    key, _, value = value.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def run_outbound(target, count: int) -> Optional[Dict[str, float]]:
+    if not count:
+        return None
+    timings = []
+    start = time.perf_counter()
+    for i in range(count):
+        sent_at = time.perf_counter()
+        target.send(i)
+        timings.append(time.perf_counter() - sent_at)
+    elapsed = time.perf_counter() - start
+    return {"rate": count / elapsed, "p50": percentile(timings, 50), "p99": percentile(timings, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", choices=sorted(TARGETS), default="ews")
+    parser.add_argument("--messages", type=int, default=1000, help="Messages to inject")
+    parser.add_argument("--burst", type=int, default=100, help="Messages injected at once")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between bursts")
+    parser.add_argument("--corpus", help="Path to a recorded AddMsgList corpus in JSON")
+    parser.add_argument("--account", help="Path to a recorded account in JSON, "
+                                           "see SyntheticAccount.from_recording")
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--mps", type=int, default=50)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--send", type=int, default=0, help="Messages to send out after ingest")
+    parser.add_argument("--hold", type=float, default=1.0, help="Long poll hold time of synccheck")
+    parser.add_argument("--latency", type=float, default=0.0, help="Server latency per request")
+    parser.add_argument("--idle", type=float, default=5.0,
+                        help="Stop waiting when nothing arrived for this many seconds")
+    parser.add_argument("--flag", type=parse_flag, action="append", default=[], metavar="KEY=VALUE",
+                        help="Flag of WeChatChannel, may be repeated")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    if args.account:
+        account = SyntheticAccount.from_recording(args.account)
+    else:
+        account = SyntheticAccount(friends=args.friends, mps=args.mps,
+                                   groups=args.groups, members=args.members)
+    messages = load_corpus(args.corpus) or account.make_messages(args.messages)
+
+    # Removed at last, after the channel has saved its state on exit.
+    data_path = tempfile.mkdtemp(prefix="ews-bench-")
+    atexit.register(shutil.rmtree, data_path, True)
+    with MockWebWeChat(account, hold=args.hold, latency=args.latency) as server:
+        itchat_config.BASE_URL = server.url
+        recorder = LatencyRecorder(server)
+
+        start = time.perf_counter()
+        target = TARGETS[args.target](recorder, data_path, dict(args.flag))
+        login_time = time.perf_counter() - start
+        rss_login = rss_mib()
+
+        start = time.perf_counter()
+        for i in range(0, len(messages), args.burst):
+            server.inject(messages[i:i + args.burst])
+            time.sleep(args.interval)
+        received = recorder.wait(len(messages), args.idle)
+        elapsed = max(recorder.arrived_at.values(), default=start) - start
+        latencies = recorder.latencies()
+
+        outbound = run_outbound(target, args.send)
+
+        target.stop()
+        server.logout()
+        rss_end = rss_mib()
+
+    print("target:              %s" % args.target)
+    print("account:             %d friends, %d MPs, %d groups of %d members" % (
+        len(account.friends), len(account.mps), len(account.groups),
+        max((len(g["MemberList"]) for g in account.groups), default=0)))
+    print("login:               %.2f s" % login_time)
+    print("messages:            %d injected, %d received" % (len(messages), received))
+    if elapsed > 0:
+        print("throughput:          %.0f msg/s" % (received / elapsed))
+    print("latency p50:         %.1f ms" % (percentile(latencies, 50) * 1e3))
+    print("latency p99:         %.1f ms" % (percentile(latencies, 99) * 1e3))
+    if latencies:
+        print("latency mean:        %.1f ms" % (statistics.mean(latencies) * 1e3))
+    if outbound:
+        print("outbound:            %.0f msg/s, p50 %.1f ms, p99 %.1f ms" % (
+            outbound["rate"], outbound["p50"] * 1e3, outbound["p99"] * 1e3))
+    print("RSS after login:     %.1f MiB" % rss_login.get("rss", float("nan")))
+    print("RSS at end:          %.1f MiB (peak %.1f MiB)" % (
+        rss_end.get("rss", float("nan")), rss_end.get("peak", float("nan"))))
+    print("requests:            %s" % ", ".join("%s=%d" % i for i in server.counters.most_common()))
+
+
+if __name__ == "__main__":
+    main()
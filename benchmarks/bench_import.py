@@ -0,0 +1,72 @@
+"""
+Measure the time to import ``efb_wechat_slave``, as EFB does on start.
+
+The channel is imported in fresh interpreters with ``-X importtime``, after
+the EFB framework is imported (which is not counted). The best run is
+reported with the modules taking the most time. With ``--budget``, the
+benchmark fails when the import takes longer than the budget, or when any
+module that should only be loaded on first use is imported.
+
+    python -m benchmarks.bench_import --runs 10 --budget 200
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Imported by EFB before loading any channel
+PRELOAD = ("ehforwarderbot", "ehforwarderbot.channel", "ehforwarderbot.chat", "ehforwarderbot.message",
+           "ehforwarderbot.status", "ehforwarderbot.exceptions", "ehforwarderbot.utils")
+
+# Modules loaded on first use, not on import
+DEFERRED = ("PIL", "magic", "pyqrcode", "yaml", "bullet", "cjkwrap", "ruamel.yaml", "multiprocessing")
+
+
+def import_once(module):
+    """Import ``module`` in a new interpreter, returning import times and the modules loaded."""
+    code = "import {}\nimport sys\nbefore = set(sys.modules)\nimport {}\n" \
+           "sys.stderr.write('MODULES ' + ' '.join(set(sys.modules) - before) + '\\n')".format(
+               ", ".join(PRELOAD), module)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("MODULES "):
+            modules = set(line.split()[1:])
+        elif line.startswith("import time:") and "|" in line:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            if self_us.strip().isdigit():
+                times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default="efb_wechat_slave")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Modules with the most self time to list")
+    parser.add_argument("--budget", type=float, help="Maximum import time in milliseconds")
+    args = parser.parse_args()
+
+    runs = [import_once(args.module) for _ in range(args.runs)]
+    totals = [times[args.module][1] / 1000 for times, _ in runs]
+    times, modules = runs[totals.index(min(totals))]
+
+    print("import %s: best %.1f ms, median %.1f ms (%d runs)" % (
+        args.module, min(totals), statistics.median(totals), len(totals)))
+    own = {name: t for name, t in times.items() if name in modules}
+    for name, (self_us, cumulative_us) in sorted(own.items(), key=lambda i: -i[1][0])[:args.top]:
+        print("  %-60s self %6.1f ms  cumulative %6.1f ms" % (name, self_us / 1000, cumulative_us / 1000))
+
+    loaded = sorted(m for m in DEFERRED if m in modules)
+    print("deferred modules imported: %s" % (", ".join(loaded) or "none"))
+    if args.budget is not None:
+        if loaded or min(totals) > args.budget:
+            print("FAIL: over the budget of %.1f ms or deferred modules imported" % args.budget)
+            sys.exit(1)
+        print("OK: within the budget of %.1f ms" % args.budget)
+
+
+if __name__ == "__main__":
+    main()
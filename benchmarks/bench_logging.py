@@ -0,0 +1,89 @@
+"""
+Measure the cost of logging in ``wxpy.Bot._process_message`` with DEBUG off.
+
+A ``wxpy.Bot`` logs in to ``benchmarks.mock_server`` and registers the same
+handlers as ``WeChatChannel``. Messages produced from a synthetic (or
+recorded) corpus are then processed with logging at INFO, as is, and with
+the message formatted eagerly as before logging was made lazy, which
+resolves the sender, receiver and group member of every message.
+
+    python -m benchmarks.bench_logging --messages 5000
+"""
+import argparse
+import copy
+import logging
+import statistics
+import time
+
+from efb_wechat_slave.vendor.itchat import config as itchat_config
+from efb_wechat_slave.vendor.itchat.components.messages import produce_msg
+
+from .bench_dispatch import EWS_MSG_TYPES
+from .fixtures import SyntheticAccount, load_corpus
+from .mock_server import MockWebWeChat
+
+
+def time_process(process, messages, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in messages:
+            process(msg)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000, help="Size of the synthetic corpus")
+    parser.add_argument("--corpus", help="Path to a recorded AddMsgList corpus in JSON")
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("efb_wechat_slave.vendor.wxpy").setLevel(logging.INFO)
+
+    from efb_wechat_slave.vendor import wxpy
+    from efb_wechat_slave.vendor.wxpy.api.messages import Message
+
+    account = SyntheticAccount(friends=args.friends, groups=args.groups, members=args.members)
+    with MockWebWeChat(account) as server:
+        itchat_config.BASE_URL = server.url
+        bot = wxpy.Bot(qr_callback=lambda **_: None, login_callback=lambda: None,
+                       start_immediately=False)
+        bot.auto_mark_as_read = False
+
+        def handler(msg):
+            pass
+
+        for msg_type in EWS_MSG_TYPES:
+            bot.register(msg_types=msg_type, except_self=False, run_async=False)(handler)
+
+        corpus = load_corpus(args.corpus) or account.make_messages(args.messages)
+        # Stay offline: groups are "updated" from the local store, without fetching
+        # members missing from a recorded corpus.
+        bot.core.update_chatroom = lambda user_name, *_, **__: bot.core.search_chatrooms(userName=user_name)
+        messages = [Message(raw, bot) for raw in produce_msg(bot.core, copy.deepcopy(corpus))]
+
+        def eager(msg):
+            config = bot.registered.get_config(msg)
+            '{}: new message (func: {}):\n{}'.format(bot, config.func.__name__ if config else None, msg)
+            bot._process_message(msg)
+
+        lazy = time_process(bot._process_message, messages, args.repeat)
+        formatted = time_process(eager, messages, args.repeat)
+
+        bot.cleanup()
+        server.logout()
+
+    print("messages per run:  %d" % len(messages))
+    for name, timings in (("lazy logging", lazy), ("eager format", formatted)):
+        print("%-18s %.2f us/msg (median run %.1f ms)" % (
+            name + ":", min(timings) / len(messages) * 1e6, statistics.median(timings) * 1e3))
+    print("saving:            %.2f us/msg" % ((min(formatted) - min(lazy)) / len(messages) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Time from first login to ready against a mock Web WeChat server.
+
+A ``wxpy.Bot`` logs in to ``benchmarks.mock_server`` serving a synthetic
+account, which loads contacts through ``webwxgetcontact`` in pages of
+``--page-size``. Reported are the time to load contacts, when the first
+and last page was merged (as reported to ``contacts_callback``), and the
+total time until the bot is ready to receive messages.
+
+    python -m benchmarks.bench_login --friends 10000 --page-size 500 --latency 0.05
+"""
+import argparse
+import logging
+import statistics
+import time
+
+from efb_wechat_slave.vendor.itchat import config as itchat_config
+
+from .fixtures import SyntheticAccount
+from .mock_server import MockWebWeChat
+
+
+def login_once(server):
+    from efb_wechat_slave.vendor import wxpy
+
+    pages = []
+    start = time.perf_counter()
+
+    def on_progress(loaded, done):
+        pages.append((time.perf_counter() - start, loaded))
+
+    bot = wxpy.Bot(qr_callback=lambda **_: None, login_callback=lambda: None,
+                   start_immediately=False, contacts_callback=on_progress)
+    ready = time.perf_counter() - start
+    contacts = len(bot.core.memberList) + len(bot.core.mpList) + len(bot.core.chatroomList)
+    bot.cleanup()
+    server.logout()
+    return dict(ready=ready, pages=pages, contacts=contacts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--friends", type=int, default=10000)
+    parser.add_argument("--mps", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=500, help="Contacts per page of webwxgetcontact")
+    parser.add_argument("--latency", type=float, default=0.0, help="Server latency per request")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    account = SyntheticAccount(friends=args.friends, mps=args.mps,
+                               groups=args.groups, members=args.members)
+    runs = []
+    with MockWebWeChat(account, page_size=args.page_size, latency=args.latency) as server:
+        itchat_config.BASE_URL = server.url
+        for _ in range(args.repeat):
+            runs.append(login_once(server))
+        requests = server.counters["webwxgetcontact"]
+
+    last = runs[-1]
+    print("contacts:            %d in %d pages" % (last["contacts"], len(last["pages"])))
+    print("webwxgetcontact:     %d requests in %d runs" % (requests, len(runs)))
+    print("first page merged:   %.1f ms (median)" % (
+        statistics.median(run["pages"][0][0] for run in runs) * 1e3))
+    print("contacts loaded:     %.1f ms (median)" % (
+        statistics.median(run["pages"][-1][0] for run in runs) * 1e3))
+    print("ready:               %.1f ms (median), %.1f ms (best)" % (
+        statistics.median(run["ready"] for run in runs) * 1e3, min(run["ready"] for run in runs) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
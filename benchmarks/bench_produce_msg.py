@@ -0,0 +1,59 @@
+"""
+Measure per-message parse cost of ``itchat.components.messages.produce_msg``.
+
+By default a synthetic corpus is generated, a recorded one can be supplied
+with ``--corpus`` (a JSON list of ``AddMsgList`` entries or of ``webwxsync``
+responses).
+
+    python -m benchmarks.bench_produce_msg --messages 5000
+"""
+import argparse
+import copy
+import statistics
+import time
+from collections import Counter
+
+from efb_wechat_slave.vendor.itchat import Core
+from efb_wechat_slave.vendor.itchat.components.messages import produce_msg
+
+from .fixtures import SyntheticAccount, load_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000, help="Size of the synthetic corpus")
+    parser.add_argument("--corpus", help="Path to a recorded AddMsgList corpus in JSON")
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    account = SyntheticAccount(friends=args.friends, groups=args.groups, members=args.members)
+    core = Core()
+    account.populate_core(core)
+    # Stay offline: members missing from a recorded corpus are not fetched.
+    core.update_chatroom = lambda *_, **__: None
+
+    corpus = load_corpus(args.corpus) or account.make_messages(args.messages)
+    batches = [copy.deepcopy(corpus) for _ in range(args.repeat)]
+
+    timings = []
+    types = Counter()
+    for batch in batches:
+        start = time.perf_counter()
+        result = produce_msg(core, batch)
+        timings.append(time.perf_counter() - start)
+        types = Counter(m["Type"] for m in result)
+
+    best = min(timings)
+    print("messages per run:  %d" % len(corpus))
+    print("best run:          %.1f ms" % (best * 1e3))
+    print("median run:        %.1f ms" % (statistics.median(timings) * 1e3))
+    print("per message:       %.2f us" % (best / len(corpus) * 1e6))
+    print("throughput:        %.0f msg/s" % (len(corpus) / best))
+    print("types:             %s" % ", ".join("%s=%d" % i for i in types.most_common()))
+
+
+if __name__ == "__main__":
+    main()
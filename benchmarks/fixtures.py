@@ -0,0 +1,237 @@
+"""
+Synthetic Web WeChat accounts and message payloads for benchmarks.
+
+All data generated here is deterministic for a given seed, and shaped after
+anonymised responses of ``webwxgetcontact`` and the ``AddMsgList`` of
+``webwxsync``.
+"""
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+SELF_USER_NAME = "@" + "5e1f" * 16
+SELF_NICK_NAME = "Benchmark Self"
+
+APP_MSG_SHARING = """<msg><appmsg appid="" sdkver="0"><title>Article {i}</title>\
+<des>Description of article {i}</des><type>5</type>\
+<url>https://mp.weixin.qq.com/s/{i}</url><thumburl>https://mmbiz.qpic.cn/{i}</thumburl></appmsg>\
+<appinfo><version>1</version><appname>Benchmark App</appname></appinfo></msg>"""
+
+APP_MSG_FILE = """<msg><appmsg appid="" sdkver="0"><title>report-{i}.pdf</title><type>6</type>\
+<appattach><totallen>{size}</totallen><fileext>pdf</fileext></appattach></appmsg></msg>"""
+
+APP_MSG_TRANSFER = """<msg><appmsg><title><![CDATA[微信转账]]></title>\
+<des><![CDATA[收到转账{i}.00元。如需收钱，请点此升级至最新版本]]></des><type>2000</type></appmsg></msg>"""
+
+LOCATION_MSG = """<?xml version="1.0"?>\n<msg><location x="22.543" y="114.058" scale="16" \
+label="Some street 1" maptype="0" poiname="Somewhere" /></msg>"""
+
+RECALL_MSG = """<sysmsg type="revokemsg"><revokemsg><session>{chat}</session>\
+<oldmsgid>{i}</oldmsgid><msgid>{i}</msgid><replacemsg><![CDATA["Someone" recalled a message]]>\
+</replacemsg></revokemsg></sysmsg>"""
+
+
+class SyntheticAccount:
+    """A deterministic set of friends, MPs and groups for one logged in user."""
+
+    def __init__(self, friends: int = 200, mps: int = 20, groups: int = 20,
+                 members: int = 100, seed: int = 0):
+        self.random = random.Random(seed)
+        self.self_contact = self._make_user(SELF_USER_NAME, SELF_NICK_NAME)
+        self.friends: List[Dict[str, Any]] = [
+            self._make_user(self._user_name(), "Friend %d" % i,
+                            remark_name=("Remark %d" % i) if i % 3 == 0 else "")
+            for i in range(friends)
+        ]
+        self.mps: List[Dict[str, Any]] = [
+            self._make_user(self._user_name(), "Official account %d" % i, verify_flag=24)
+            for i in range(mps)
+        ]
+        self.groups: List[Dict[str, Any]] = [
+            self._make_group(i, members) for i in range(groups)
+        ]
+
+    def _user_name(self, prefix: str = "@") -> str:
+        return prefix + "%064x" % self.random.getrandbits(256)
+
+    def _make_user(self, user_name: str, nick_name: str, remark_name: str = "",
+                   verify_flag: int = 0) -> Dict[str, Any]:
+        return {
+            "Uin": 0, "UserName": user_name, "NickName": nick_name,
+            "HeadImgUrl": "/cgi-bin/mmwebwx-bin/webwxgeticon?seq=0&username=%s&skey=" % user_name,
+            "ContactFlag": 3, "MemberCount": 0, "MemberList": [], "RemarkName": remark_name,
+            "HideInputBarFlag": 0, "Sex": self.random.choice((0, 1, 2)),
+            "Signature": "", "VerifyFlag": verify_flag, "OwnerUin": 0,
+            "PYInitial": "", "PYQuanPin": "", "RemarkPYInitial": "", "RemarkPYQuanPin": "",
+            "StarFriend": 0, "AppAccountFlag": 0, "Statues": 0, "AttrStatus": 0,
+            "Province": "", "City": "", "Alias": "", "SnsFlag": 1, "UniFriend": 0,
+            "DisplayName": "", "ChatRoomId": 0, "KeyWord": "", "EncryChatRoomId": "",
+            "IsOwner": 0,
+        }
+
+    def _make_member(self, user_name: str, nick_name: str, display_name: str = "") -> Dict[str, Any]:
+        return {
+            "Uin": 0, "UserName": user_name, "NickName": nick_name, "AttrStatus": 0,
+            "PYInitial": "", "PYQuanPin": "", "RemarkPYInitial": "", "RemarkPYQuanPin": "",
+            "MemberStatus": 0, "DisplayName": display_name, "KeyWord": "",
+        }
+
+    def _make_group(self, index: int, members: int) -> Dict[str, Any]:
+        group = self._make_user(self._user_name("@@"), "Group %d" % index)
+        member_list = [self._make_member(SELF_USER_NAME, SELF_NICK_NAME)]
+        for i in range(members - 1):
+            member_list.append(self._make_member(
+                self._user_name(), "Member %d-%d" % (index, i),
+                display_name=("Card %d" % i) if i % 5 == 0 else ""))
+        group.update({"MemberList": member_list, "MemberCount": len(member_list), "Statues": 1,
+                      "EncryChatRoomId": "@%032x" % self.random.getrandbits(128)})
+        return group
+
+    @classmethod
+    def from_recording(cls, path: str) -> "SyntheticAccount":
+        """
+        Load an account from a recorded JSON file with the ``User`` of
+        ``webwxinit``, the ``MemberList`` of ``webwxgetcontact``, and
+        optionally the ``ContactList`` of ``webwxbatchgetcontact`` with group members.
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        account = cls(friends=0, mps=0, groups=0)
+        account.self_contact = data["User"]
+        groups = {i["UserName"]: i for i in data["MemberList"] if i["UserName"].startswith("@@")}
+        groups.update((i["UserName"], i) for i in data.get("ContactList", ())
+                      if i["UserName"].startswith("@@"))
+        account.groups = list(groups.values())
+        for i in data["MemberList"]:
+            if i["UserName"].startswith("@@"):
+                continue
+            (account.mps if i.get("VerifyFlag", 0) & 8 else account.friends).append(i)
+        return account
+
+    @property
+    def contacts(self) -> List[Dict[str, Any]]:
+        """Contacts as returned by ``webwxgetcontact``, without group members."""
+        groups = [dict(i, MemberList=[], MemberCount=0) for i in self.groups]
+        return self.friends + self.mps + groups
+
+    def populate_core(self, core, base_url: str = "https://wx.qq.com/cgi-bin/mmwebwx-bin"):
+        """Fill an ``itchat.Core`` with this account as if it has just logged in."""
+        from efb_wechat_slave.vendor.itchat.storage import templates
+
+        core.loginInfo.update({
+            "url": base_url, "fileUrl": base_url, "syncUrl": base_url,
+            "skey": "@crypt_benchmark", "wxuin": "1234567890", "wxsid": "benchmark",
+            "pass_ticket": "benchmark", "deviceid": "e000000000000000",
+            "logintime": int(time.time() * 1e3),
+            "SyncKey": {"Count": 0, "List": []}, "synckey": "",
+        })
+        core.loginInfo["BaseRequest"] = {
+            "Skey": core.loginInfo["skey"], "Sid": "benchmark",
+            "Uin": core.loginInfo["wxuin"], "DeviceID": core.loginInfo["deviceid"]}
+        core.loginInfo["User"] = templates.User(self.self_contact)
+        core.loginInfo["User"].core = core
+        core.s.cookies.set("webwx_data_ticket", "benchmark")
+        core.storageClass.userName = SELF_USER_NAME
+        core.storageClass.nickName = SELF_NICK_NAME
+        core.memberList.append(self.self_contact)
+        for i in self.friends:
+            core.memberList.append(i)
+        for i in self.mps:
+            core.mpList.append(i)
+        for i in self.groups:
+            core.chatroomList.append(i)
+        for chatroom in core.chatroomList:
+            chatroom["Self"] = chatroom["MemberList"][0]
+        core.alive = True
+
+    def make_messages(self, count: int, start_id: int = 1) -> List[Dict[str, Any]]:
+        """
+        Generate ``count`` raw ``AddMsgList`` entries with a realistic mix of types:
+        mostly text, with pictures, stickers, voice, videos, app messages and
+        system notices.
+        """
+        kinds = (["text"] * 10 + ["group_text"] * 16 + ["self_group_text"] * 2 +
+                 ["picture"] * 3 + ["sticker"] * 2 + ["voice", "video", "map", "card"] +
+                 ["sharing"] * 3 + ["file", "transfer", "note", "recall", "status", "useless"])
+        messages = []
+        for i in range(start_id, start_id + count):
+            messages.append(self._make_message(self.random.choice(kinds), i))
+        return messages
+
+    def _make_message(self, kind: str, msg_id: int) -> Dict[str, Any]:
+        friend = self.random.choice(self.friends) if self.friends else self.self_contact
+        group = self.random.choice(self.groups) if self.groups else None
+        if group is None and "group" in kind:
+            kind = "text"
+        m = {
+            "MsgId": str(msg_id), "FromUserName": friend["UserName"], "ToUserName": SELF_USER_NAME,
+            "MsgType": 1, "Content": "Message %d" % msg_id, "Status": 3, "ImgStatus": 1,
+            "CreateTime": int(time.time()), "VoiceLength": 0, "PlayLength": 0, "FileName": "",
+            "FileSize": "", "MediaId": "", "Url": "", "AppMsgType": 0, "StatusNotifyCode": 0,
+            "StatusNotifyUserName": "", "RecommendInfo": {
+                "UserName": "", "NickName": "", "QQNum": 0, "Province": "", "City": "",
+                "Content": "", "Signature": "", "Alias": "", "Scene": 0, "VerifyFlag": 0,
+                "AttrStatus": 0, "Sex": 0, "Ticket": "", "OpCode": 0},
+            "ForwardFlag": 0, "AppInfo": {"AppID": "", "Type": 0}, "HasProductId": 0,
+            "Ticket": "", "ImgHeight": 0, "ImgWidth": 0, "SubMsgType": 0,
+            "NewMsgId": msg_id, "OriContent": "", "EncryFileName": "",
+        }
+        if kind == "group_text":
+            member = self.random.choice(group["MemberList"][1:] or group["MemberList"])
+            m.update(FromUserName=group["UserName"],
+                     Content="%s:<br/>Group message %d &amp; more" % (member["UserName"], msg_id))
+        elif kind == "self_group_text":
+            m.update(FromUserName=SELF_USER_NAME, ToUserName=group["UserName"])
+        elif kind == "picture":
+            m.update(MsgType=3, Content="", ImgHeight=480, ImgWidth=640)
+        elif kind == "sticker":
+            m.update(MsgType=47, Content="")
+        elif kind == "voice":
+            m.update(MsgType=34, Content="", VoiceLength=3000)
+        elif kind == "video":
+            m.update(MsgType=43, Content="", PlayLength=10)
+        elif kind == "map":
+            m.update(Content="Somewhere (Some street 1):<br/>/cgi-bin/mmwebwx-bin/webwxgetpubliclinkimg",
+                     Url="https://apis.map.qq.com/uri/v1/geocoder?coord=0,0", SubMsgType=48,
+                     OriContent=LOCATION_MSG)
+        elif kind == "card":
+            card = self.random.choice(self.friends) if self.friends else friend
+            m.update(MsgType=42, Content="", RecommendInfo=dict(
+                m["RecommendInfo"], UserName=card["UserName"], NickName=card["NickName"]))
+        elif kind == "sharing":
+            m.update(MsgType=49, AppMsgType=5, FileName="Article %d" % msg_id,
+                     Content=APP_MSG_SHARING.format(i=msg_id),
+                     Url="https://mp.weixin.qq.com/s/%d" % msg_id)
+        elif kind == "file":
+            m.update(MsgType=49, AppMsgType=6, FileName="report-%d.pdf" % msg_id, FileSize="1024",
+                     MediaId="@crypt_%d" % msg_id, Content=APP_MSG_FILE.format(i=msg_id, size=1024))
+        elif kind == "transfer":
+            m.update(MsgType=49, AppMsgType=2000, FileName="微信转账",
+                     Content=APP_MSG_TRANSFER.format(i=msg_id))
+        elif kind == "note":
+            m.update(MsgType=10000, Content="You have added Friend as your WeChat contact.")
+        elif kind == "recall":
+            m.update(MsgType=10002, Content=RECALL_MSG.format(i=msg_id - 1, chat=friend["UserName"]))
+        elif kind == "status":
+            m.update(MsgType=51, FromUserName=SELF_USER_NAME, ToUserName=friend["UserName"],
+                     Content="", StatusNotifyCode=2)
+        elif kind == "useless":
+            m.update(MsgType=9999, Content="")
+        return m
+
+
+def load_corpus(path: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Load a recorded corpus of raw ``AddMsgList`` entries from a JSON file.
+
+    The file may contain either a list of messages, or a list of
+    ``webwxsync`` responses each with its own ``AddMsgList``.
+    """
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data and isinstance(data, list) and "AddMsgList" in data[0]:
+        return [m for response in data for m in response["AddMsgList"]]
+    return data
@@ -0,0 +1,333 @@
+"""
+A local stand-in for the Web WeChat server.
+
+:class:`MockWebWeChat` serves the login flow, contacts, long polling,
+sending, uploading and media downloads of one account over plain HTTP on
+localhost. Point itchat at it with::
+
+    with MockWebWeChat(SyntheticAccount()) as server:
+        itchat.config.BASE_URL = server.url
+        bot = wxpy.Bot(...)
+        server.inject(account.make_messages(100))
+
+Messages injected are delivered through ``synccheck`` and ``webwxsync`` as
+the real server does, and the time of each step is recorded by ``MsgId`` so
+that benchmarks can measure latency from ingest.
+"""
+import base64
+import itertools
+import json
+import logging
+import socketserver
+import threading
+import time
+from collections import Counter, deque
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .fixtures import SyntheticAccount
+
+logger = logging.getLogger(__name__)
+
+# 1x1 transparent GIF, readable as both a picture and a sticker.
+GIF_BYTES = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+# Arbitrary payload for voice, video and attachments.
+MEDIA_BYTES = bytes(range(256)) * 16
+
+SYNC_KEY_COUNT = 4
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockWebWeChat:
+    """
+    Emulated Web WeChat server for one logged in account.
+
+    Args:
+        account: Contacts and self of the account.
+        host: Interface to listen on.
+        port: Port to listen on, 0 to pick a free one.
+        hold: Seconds a ``synccheck`` is held open while no message is
+            pending, as the long poll of the real server.
+        page_size: Contacts per page of ``webwxgetcontact``.
+        batch_size: Maximum messages delivered by one ``webwxsync``.
+        latency: Seconds added to every response.
+        throttle_every: Reject every n-th message sent with error 1205,
+            0 to never reject.
+    """
+
+    def __init__(self, account: SyntheticAccount, host: str = "127.0.0.1", port: int = 0,
+                 hold: float = 1.0, page_size: int = 1000, batch_size: int = 100,
+                 latency: float = 0.0, throttle_every: int = 0):
+        self.account = account
+        self.hold = hold
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.latency = latency
+        self.throttle_every = throttle_every
+
+        self.contacts: Dict[str, Dict[str, Any]] = {
+            i["UserName"]: i for i in itertools.chain(
+                [account.self_contact], account.friends, account.mps, account.groups)}
+        self.counters: Counter = Counter()
+        self.sent: List[Tuple[str, Dict[str, Any]]] = []
+        self.injected_at: Dict[str, float] = {}
+        self.delivered_at: Dict[str, float] = {}
+
+        self.logged_in = False
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._condition = threading.Condition()
+        self._sync_key = 1
+        self._msg_ids = itertools.count(10 ** 18)
+        self._media_ids = itertools.count(1)
+        self._sends = 0
+
+        self._httpd = _ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to be used as ``itchat.config.BASE_URL``."""
+        host, port = self._httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    @property
+    def api_url(self) -> str:
+        return self.url + "/cgi-bin/mmwebwx-bin"
+
+    def start(self) -> "MockWebWeChat":
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name="Mock Web WeChat server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.logout()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockWebWeChat":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def inject(self, messages: Iterable[Dict[str, Any]]):
+        """Queue raw ``AddMsgList`` entries to be delivered to the client."""
+        now = time.perf_counter()
+        with self._condition:
+            for m in messages:
+                self.injected_at[str(m["MsgId"])] = now
+                self._pending.append(m)
+            self._condition.notify_all()
+
+    def logout(self):
+        """Log the client out, as if done on the phone."""
+        with self._condition:
+            self.logged_in = False
+            self._condition.notify_all()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # region [Endpoints]
+
+    def _sync_key_json(self) -> Dict[str, Any]:
+        return {"Count": SYNC_KEY_COUNT,
+                "List": [{"Key": i + 1, "Val": self._sync_key} for i in range(SYNC_KEY_COUNT)]}
+
+    @staticmethod
+    def _base_response(ret: int = 0) -> Dict[str, Any]:
+        return {"Ret": ret, "ErrMsg": ""}
+
+    def handle_root(self, query, body):
+        return "text/html", b"<html></html>", None
+
+    def handle_jslogin(self, query, body):
+        return "text/javascript", b'window.QRLogin.code = 200; window.QRLogin.uuid = "bench_uuid==";', None
+
+    def handle_webwxpushloginurl(self, query, body):
+        return {"ret": "0", "msg": "all ok", "uuid": "bench_uuid=="}
+
+    def handle_login(self, query, body):
+        redirect = self.api_url + "/webwxnewloginpage?ticket=bench_ticket&uuid=bench_uuid==&lang=zh_CN&scan=1"
+        text = 'window.code=200;\nwindow.redirect_uri="%s";' % redirect
+        return "text/javascript", text.encode(), None
+
+    def handle_webwxnewloginpage(self, query, body):
+        self.logged_in = True
+        cookies = {"wxsid": "bench_sid", "wxuin": "1234567890", "webwx_data_ticket": "bench_ticket"}
+        text = ("<error><ret>0</ret><message></message><skey>@crypt_bench</skey>"
+                "<wxsid>bench_sid</wxsid><wxuin>1234567890</wxuin>"
+                "<pass_ticket>bench_pass_ticket</pass_ticket><isgrayscale>1</isgrayscale></error>")
+        return "text/plain", text.encode(), cookies
+
+    def handle_webwxinit(self, query, body):
+        return {
+            "BaseResponse": self._base_response(),
+            "Count": 0, "ContactList": [], "SyncKey": self._sync_key_json(),
+            "User": self.account.self_contact, "ChatSet": "", "SKey": "@crypt_bench",
+            "ClientVersion": 0, "SystemTime": int(time.time()), "GrayScale": 1,
+            "InviteStartCount": 40, "MPSubscribeMsgCount": 0, "MPSubscribeMsgList": [],
+            "ClickReportInterval": 600000,
+        }
+
+    def handle_webwxstatusnotify(self, query, body):
+        return {"BaseResponse": self._base_response(), "MsgID": str(next(self._msg_ids))}
+
+    def handle_webwxgetcontact(self, query, body):
+        contacts = self.account.contacts
+        seq = int(query.get("seq", ["0"])[0] or 0)
+        page = contacts[seq:seq + self.page_size]
+        next_seq = seq + self.page_size if seq + self.page_size < len(contacts) else 0
+        return {"BaseResponse": self._base_response(), "MemberCount": len(page),
+                "MemberList": page, "Seq": next_seq}
+
+    def handle_webwxbatchgetcontact(self, query, body):
+        found = []
+        for item in body.get("List", []):
+            contact = self.contacts.get(item.get("UserName"))
+            if contact is not None:
+                found.append(contact)
+        return {"BaseResponse": self._base_response(), "Count": len(found), "ContactList": found}
+
+    def handle_synccheck(self, query, body):
+        with self._condition:
+            if self.logged_in and not self._pending:
+                self._condition.wait(self.hold)
+            if not self.logged_in:
+                retcode, selector = 1101, 0
+            else:
+                retcode, selector = 0, 2 if self._pending else 0
+        text = 'window.synccheck={retcode:"%d",selector:"%d"}' % (retcode, selector)
+        return "text/javascript", text.encode(), None
+
+    def handle_webwxsync(self, query, body):
+        with self._condition:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._sync_key += 1
+            sync_key = self._sync_key_json()
+        now = time.perf_counter()
+        for m in batch:
+            self.delivered_at[str(m["MsgId"])] = now
+        return {
+            "BaseResponse": self._base_response(), "AddMsgCount": len(batch), "AddMsgList": batch,
+            "ModContactCount": 0, "ModContactList": [], "DelContactCount": 0, "DelContactList": [],
+            "ModChatRoomMemberCount": 0, "ModChatRoomMemberList": [], "Profile": {},
+            "ContinueFlag": 0, "SyncKey": sync_key, "SyncCheckKey": sync_key, "SKey": "",
+        }
+
+    def _handle_send(self, endpoint, body):
+        self.sent.append((endpoint, body))
+        self._sends += 1
+        if self.throttle_every and self._sends % self.throttle_every == 0:
+            return {"BaseResponse": self._base_response(1205), "MsgID": "", "LocalID": ""}
+        local_id = (body.get("Msg") or {}).get("LocalID", "")
+        return {"BaseResponse": self._base_response(), "MsgID": str(next(self._msg_ids)),
+                "LocalID": str(local_id)}
+
+    def handle_webwxsendmsg(self, query, body):
+        return self._handle_send("webwxsendmsg", body)
+
+    def handle_webwxsendmsgimg(self, query, body):
+        return self._handle_send("webwxsendmsgimg", body)
+
+    def handle_webwxsendemoticon(self, query, body):
+        return self._handle_send("webwxsendemoticon", body)
+
+    def handle_webwxsendappmsg(self, query, body):
+        return self._handle_send("webwxsendappmsg", body)
+
+    def handle_webwxsendvideomsg(self, query, body):
+        return self._handle_send("webwxsendvideomsg", body)
+
+    def handle_webwxuploadmedia(self, query, body):
+        return {"BaseResponse": self._base_response(), "MediaId": "@crypt_media_%d" % next(self._media_ids),
+                "StartPos": 0, "CDNThumbImgHeight": 0, "CDNThumbImgWidth": 0, "EncryFileName": ""}
+
+    def handle_webwxgetmsgimg(self, query, body):
+        return "image/gif", GIF_BYTES, None
+
+    handle_webwxgeticon = handle_webwxgetheadimg = handle_webwxgetmsgimg
+
+    def handle_webwxgetvoice(self, query, body):
+        return "audio/mpeg", MEDIA_BYTES, None
+
+    def handle_webwxgetvideo(self, query, body):
+        return "video/mp4", MEDIA_BYTES, None
+
+    def handle_webwxgetmedia(self, query, body):
+        return "application/octet-stream", MEDIA_BYTES, None
+
+    def handle_webwxlogout(self, query, body):
+        self.logout()
+        return "text/html", b"", None
+
+    # endregion [Endpoints]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockWebWeChat"
+    # Write headers and body in one segment, so that clients are not held by delayed ACKs.
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        mock: MockWebWeChat = self.server.mock
+        parts = urlsplit(self.path)
+        endpoint = parts.path.rstrip("/").rsplit("/", 1)[-1] or "root"
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body: Dict[str, Any] = {}
+        if raw and not self.headers.get("Content-Type", "").startswith("multipart/"):
+            try:
+                body = json.loads(raw.decode("utf-8", "replace"))
+            except ValueError:
+                pass
+        mock.counters[endpoint] += 1
+
+        handler = getattr(mock, "handle_" + endpoint, None)
+        if handler is None:
+            logger.warning("Unknown endpoint requested: %s", self.path)
+            self._respond(404, "text/plain", b"")
+            return
+        if mock.latency:
+            time.sleep(mock.latency)
+        result = handler(parse_qs(parts.query), body)
+        if isinstance(result, tuple):
+            content_type, payload, cookies = result
+        else:
+            content_type, payload, cookies = "application/json", json.dumps(result).encode(), None
+        self._respond(200, content_type, payload, cookies)
+
+    def _respond(self, status: int, content_type: str, payload: bytes,
+                 cookies: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        if cookies:
+            jar = SimpleCookie()
+            for key, value in cookies.items():
+                jar[key] = value
+                jar[key]["path"] = "/"
+            for morsel in jar.values():
+                self.send_header("Set-Cookie", morsel.OutputString())
+        self.end_headers()
+        self.wfile.write(payload)
@@ -3,6 +3,7 @@
 import io
 import json
 import logging
+import os
 import tempfile
 import time
 import threading
@@ -13,10 +14,7 @@ from tempfile import NamedTemporaryFile
 from typing import Any, Dict, Optional, List, Tuple, Callable, BinaryIO, IO
 from uuid import uuid4
 
-import yaml
-from PIL import Image
 from pkg_resources import resource_filename
-from pyqrcode import QRCode
 from typing_extensions import Final
 
 from ehforwarderbot import Message, MsgType, Status, Chat, coordinator
@@ -32,11 +30,16 @@ from ehforwarderbot.utils import extra
 from . import utils as ews_utils
 from .__version__ import __version__
 from .chats import ChatManager
+from .media_cache import MediaCache
+from .media_converter import EXTENSIONS, ConversionError, MediaConverter
+from .message_index import MessageIndex
+from .send_scheduler import SendScheduler
 from .slave_message import SlaveMessageManager
 from .utils import ExperimentalFlagsManager
 from .vendor import wxpy
+from .vendor.itchat.poll import PollController
 from .vendor.wxpy import ResponseError
-from .vendor.wxpy.utils import PuidMap
+from .vendor.wxpy.utils import LogSink, MetricsExporter, MetricsRegistry, PrometheusFileSink, PuidMap
 
 
 class WeChatChannel(SlaveChannel):
@@ -153,6 +156,17 @@ class WeChatChannel(SlaveChannel):
         PuidMap.SYSTEM_ACCOUNTS = self.SYSTEM_ACCOUNTS
 
         self.flag: ExperimentalFlagsManager = ExperimentalFlagsManager(self)
+        self.send_scheduler: SendScheduler = SendScheduler(self)
+        self.media_converter: MediaConverter = MediaConverter(self.flag('media_conversion_workers'))
+        self.media_cache: MediaCache = MediaCache(efb_utils.get_data_path(self.channel_id) / "media_cache",
+                                                  self.flag('media_cache_size') * 2 ** 20)
+        self.message_index: MessageIndex = MessageIndex(efb_utils.get_data_path(self.channel_id) / "messages.db",
+                                                        self.flag('message_index_size'),
+                                                        self.flag('message_index_days') * 24 * 60 * 60)
+        self.message_index.start()
+        self.metrics: Optional[MetricsRegistry] = None
+        self.metrics_exporter: Optional[MetricsExporter] = None
+        self.setup_metrics()
 
         self.qr_uuid: Tuple[str, int] = ('', 0)
         self.master_qr_picture_id: Optional[str] = None
@@ -161,6 +175,8 @@ class WeChatChannel(SlaveChannel):
 
         # Managers
         self.slave_message: SlaveMessageManager = SlaveMessageManager(self)
+        if self.metrics:
+            self.slave_message.recall_msg_id_conversion.register_metrics(self.metrics, 'recall_index')
         self.chats: ChatManager = ChatManager(self)
         self.user_auth_chat = SystemChat(channel=self,
                                          name=self._("EWS User Auth"),
@@ -175,12 +191,38 @@ class WeChatChannel(SlaveChannel):
         config_path = efb_utils.get_config_path(self.channel_id)
         if not config_path.exists():
             return
+        import yaml
         with config_path.open() as f:
             d = yaml.full_load(f)
             if not d:
                 return
             self.config: Dict[str, Any] = d
 
+    def setup_metrics(self):
+        """
+        Enable metrics of the message pipeline if the flag ``metrics_sink``
+        is set, and export them periodically.
+        """
+        sink_type = self.flag('metrics_sink')
+        if not sink_type or sink_type == "off":
+            return
+        self.metrics = MetricsRegistry()
+        self.metrics.gauge('name_cache_size', lambda: ews_utils.wechat_name_unescape.cache_info().currsize)
+        self.send_scheduler.register_metrics(self.metrics)
+        self.message_index.register_metrics(self.metrics)
+
+        sink: Any = None
+        if sink_type == "log":
+            sink = LogSink(self.logger)
+        elif sink_type == "prometheus":
+            path = self.flag('metrics_path') or efb_utils.get_data_path(self.channel_id) / "metrics.prom"
+            sink = PrometheusFileSink(path)
+        elif sink_type != "registry":
+            self.logger.error('Not identified value for flag "metrics_sink". Metrics are kept in memory only.')
+        if sink is not None:
+            self.metrics_exporter = MetricsExporter(self.metrics, sink, self.flag('metrics_interval'))
+            self.metrics_exporter.start()
+
     #
     # Utilities
     #
@@ -205,6 +247,7 @@ class WeChatChannel(SlaveChannel):
                 qr += self._("QR code expired, please scan the new one.") + "\n"
             qr += "\n"
             qr_url = "https://login.weixin.qq.com/l/" + uuid
+            from pyqrcode import QRCode
             qr_obj = QRCode(qr_url)
             if self.flag("imgcat_qr"):
                 qr_file = io.BytesIO()
@@ -244,6 +287,7 @@ class WeChatChannel(SlaveChannel):
             msg.type = MsgType.Image
             file = NamedTemporaryFile(suffix=".png")
             qr_url = "https://login.weixin.qq.com/l/" + uuid
+            from pyqrcode import QRCode
             QRCode(qr_url).png(file, scale=10)
             msg.text = self._("QR code expired, please scan the new one.")
             msg.path = Path(file.name)
@@ -258,6 +302,13 @@ class WeChatChannel(SlaveChannel):
         if status in (200, 201) or uuid != self.qr_uuid:
             coordinator.send_message(msg)
 
+    def contacts_progress(self, loaded: int, done: bool):
+        """Report progress of loading contacts from WeChat, page by page."""
+        if done:
+            self.logger.info("Loaded %s contacts from WeChat.", loaded)
+        else:
+            self.logger.debug("Loading contacts from WeChat, %s loaded so far...", loaded)
+
     def exit_callback(self):
         # Don't send prompt if there's nowhere to send.
         if not getattr(coordinator, 'master', None):
@@ -417,63 +468,50 @@ class WeChatChannel(SlaveChannel):
             else:
                 if msg.type == MsgType.Sticker:
                     convert_to = "image/gif"
+            if not convert_to and file.seek(0, 2) > self.MAX_FILE_SIZE:
+                # Recompress to fit in the size limit, keeping animations
+                convert_to = "image/gif" if msg.mime == "image/gif" else "image/jpeg"
 
-            if convert_to == "image/gif":
-                with NamedTemporaryFile(suffix=".gif") as f:
-                    try:
-                        img = Image.open(file)
-                        try:
-                            alpha = img.split()[3]
-                            mask = Image.eval(
-                                alpha, lambda a: 255 if a <= 128 else 0)
-                        except IndexError:
-                            mask = Image.eval(img.split()[0], lambda a: 0)
-                        img = img.convert('RGB').convert(
-                            'P', palette=Image.ADAPTIVE, colors=255)
-                        img.paste(255, mask)
-                        img.save(f, transparency=255)
-                        msg.path = Path(f.name)
-                        self.logger.debug(
-                            '[%s] Image converted from %s to GIF', msg.uid, msg.mime)
-                        file.close()
-                        if f.seek(0, 2) > self.MAX_FILE_SIZE:
-                            raise EFBMessageError(
-                                self._("Image size is too large. (IS02)"))
-                        f.seek(0)
-                        r.append(self._bot_send_image(chat, f.name, f))
-                    finally:
-                        if not file.closed:
-                            file.close()
-            elif convert_to == "image/jpeg":
-                with NamedTemporaryFile(suffix=".jpg") as f:
-                    try:
-                        img = Image.open(file).convert('RGBA')
-                        out = Image.new("RGBA", img.size, (255, 255, 255, 255))
-                        out.paste(img, img)
-                        out.convert('RGB').save(f)
-                        msg.path = Path(f.name)
-                        self.logger.debug(
-                            '[%s] Image converted from %s to JPEG', msg.uid, msg.mime)
-                        file.close()
-                        if f.seek(0, 2) > self.MAX_FILE_SIZE:
-                            raise EFBMessageError(
-                                self._("Image size is too large. (IS02)"))
-                        f.seek(0)
-                        r.append(self._bot_send_image(chat, f.name, f))
-                    finally:
-                        if not file.closed:
-                            file.close()
-            else:
+            if convert_to:
                 try:
-                    if file.seek(0, 2) > self.MAX_FILE_SIZE:
+                    file.seek(0)
+                    data = file.read()
+                finally:
+                    file.close()
+                key = self.media_cache.key(data, convert_to)
+                # Keep the name given by the user, with the extension of the new format
+                filename = msg.filename or (msg.path and msg.path.name)
+                filename = Path(filename).stem + EXTENSIONS[convert_to] if filename else key
+                sent = self._bot_send_cached_image(chat, filename, key)
+                if sent is None:
+                    try:
+                        with self.media_cache.open(key, lambda path: self.media_converter.convert(
+                                convert_to, data, path, self.MAX_FILE_SIZE)) as f:
+                            msg.path, msg.mime, msg.filename = Path(f.name), convert_to, filename
+                            self.logger.debug(
+                                '[%s] Image converted to %s', msg.uid, convert_to)
+                            if os.fstat(f.fileno()).st_size > self.MAX_FILE_SIZE:
+                                raise EFBMessageError(
+                                    self._("Image size is too large. (IS02)"))
+                            sent = self._bot_send_image(chat, filename, f, media_key=key)
+                    except ConversionError as e:
+                        self.logger.warning('[%s] Failed to convert image: %s', msg.uid, e)
                         raise EFBMessageError(
                             self._("Image size is too large. (IS01)"))
+                r.append(sent)
+            else:
+                try:
                     file.seek(0)
-                    self.logger.debug(
-                        "[%s] Sending %s (image) to WeChat.", msg.uid, msg.path)
                     filename = msg.filename or (msg.path and msg.path.name)
                     assert filename
-                    r.append(self._bot_send_image(chat, filename, file))
+                    key = self.media_cache.key(file.read(), msg.mime)
+                    sent = self._bot_send_cached_image(chat, filename, key)
+                    if sent is None:
+                        file.seek(0)
+                        self.logger.debug(
+                            "[%s] Sending %s (image) to WeChat.", msg.uid, msg.path)
+                        sent = self._bot_send_image(chat, filename, file, media_key=key)
+                    r.append(sent)
                 finally:
                     if not file.closed:
                         file.close()
@@ -505,6 +543,7 @@ class WeChatChannel(SlaveChannel):
         msg.uid = ews_utils.generate_message_uid(r)
         self.logger.debug(
             'WeChat message is assigned with unique ID: %s', msg.uid)
+        self.message_index.add(msg)
         return msg
 
     def send_status(self, status: Status):
@@ -549,10 +588,12 @@ class WeChatChannel(SlaveChannel):
     def get_chat_picture(self, chat: Chat) -> BinaryIO:
         uid = chat.uid
         if uid in wxpy.Chat.SYSTEM_ACCOUNTS:
-            wxpy_chat: wxpy.Chat = wxpy.Chat(
+            wxpy_chat: Optional[wxpy.Chat] = wxpy.Chat(
                 wxpy.utils.wrap_user_name(uid), self.bot)
         else:
-            wxpy_chat = wxpy.utils.ensure_one(self.bot.search(puid=uid))
+            wxpy_chat = self.chats.get_chat_by_puid(uid)
+        if wxpy_chat is None:
+            raise EFBChatNotFound()
         f: BinaryIO = None  # type: ignore
         try:
             f = tempfile.NamedTemporaryFile(suffix='.jpg')  # type: ignore
@@ -580,13 +621,15 @@ class WeChatChannel(SlaveChannel):
                 refresh = True
             else:
                 return self._("Unknown parameter: {}.").format(param)
-        l: List[wxpy.Chat] = self.bot.chats(refresh)
+        if refresh:
+            self.bot.update_chats(force=True)
+        l: List[wxpy.Chat] = self.bot.chats()
 
         msg = self._("Chat list:") + "\n"
         for i in l:
-            alias = ews_utils.wechat_string_unescape(getattr(i, 'remark_name', '') or
-                                                     getattr(i, 'display_name', ''))
-            name = ews_utils.wechat_string_unescape(i.nick_name)
+            alias = ews_utils.wechat_name_unescape(getattr(i, 'remark_name', '') or
+                                                   getattr(i, 'display_name', ''))
+            name = ews_utils.wechat_name_unescape(i.nick_name)
             display_name = "%s (%s)" % (
                 alias, name) if alias and alias != name else name
             chat_type = "?"
@@ -668,12 +711,24 @@ class WeChatChannel(SlaveChannel):
         qr_callback = getattr(self, qr_reload, self.master_qr_code)
         if getattr(self, 'bot', None):  # if a bot exists
             self.bot.cleanup()
+        # Media uploaded in the last session cannot be sent again by ID
+        self.media_cache.clear_media_ids()
+        poll_controller = PollController(adaptive=self.flag('adaptive_poll_timeouts'),
+                                         syncCheckTimeout=self.flag('sync_check_timeout'),
+                                         webwxSyncTimeout=self.flag('webwx_sync_timeout'),
+                                         backoffMax=self.flag('poll_backoff_max'))
         with coordinator.mutex:
             self.bot: wxpy.Bot = wxpy.Bot(cache_path=str(efb_utils.get_data_path(self.channel_id) / "wxpy.pkl"),
                                           qr_callback=qr_callback,
                                           logout_callback=self.exit_callback,
                                           user_agent=self.flag('user_agent'),
-                                          start_immediately=not first_start)
+                                          start_immediately=not first_start,
+                                          poll_controller=poll_controller,
+                                          contacts_callback=self.contacts_progress)
+            self.bot.core.receivingRetryCount = self.flag('poll_retry_attempts')
+            self.bot.read_state.window = self.flag('mark_as_read_interval')
+            self.bot.chats_refresh.min_interval = self.flag('chat_refresh_interval')
+            self.bot.enable_metrics(self.metrics)
             self.bot.enable_puid(
                 efb_utils.get_data_path(self.channel_id) / "wxpy_puid.pkl",
                 self.flag('puid_logs')
@@ -718,6 +773,11 @@ class WeChatChannel(SlaveChannel):
 
     def stop_polling(self):
         self.bot.cleanup()
+        self.media_converter.stop()
+        self.slave_message.recall_msg_id_conversion.dump()
+        self.message_index.stop()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
         if not self._stop_polling_event.is_set():
             self._stop_polling_event.set()
         else:
@@ -725,31 +785,90 @@ class WeChatChannel(SlaveChannel):
 
     def _bot_send_msg(self, chat: wxpy.Chat, message: str) -> wxpy.SentMessage:
         try:
-            return chat.send_msg(message)
+            return self.send_scheduler.submit(chat, lambda: chat.send_msg(message))
         except wxpy.ResponseError as e:
             e = self.substitute_known_error_reason(e)
             raise EFBMessageError(self._("Error from Web WeChat while sending message: [{code}] {message}")
                                   .format(code=e.err_code, message=e.err_msg))
 
+    @staticmethod
+    def _upload_once(chat: wxpy.Chat, filename: str, file: IO[bytes], media_type: str) -> Callable[[], str]:
+        """
+        Upload a file on the first call, and return the same media ID on later
+        calls, so that retries of a throttled send do not upload it again.
+        """
+        position = file.tell()
+        media_id: Optional[str] = None
+
+        def upload() -> str:
+            nonlocal media_id
+            if media_id is None:
+                file.seek(position)
+                media_id = chat.bot.upload_file(filename, file=file, media_type=media_type)
+            return media_id
+
+        return upload
+
     def _bot_send_file(self, chat: wxpy.Chat, filename: str, file: IO[bytes]) -> wxpy.SentMessage:
+        position = file.tell()
+        upload = self._upload_once(chat, filename, file, 'file')
+
+        def send() -> wxpy.SentMessage:
+            media_id = upload()
+            # Size of the file is read again to be sent along the media ID
+            file.seek(position)
+            return chat.send_file(filename, file=file, media_id=media_id)
+
         try:
-            return chat.send_file(filename, file=file)
+            return self.send_scheduler.submit(chat, send)
         except wxpy.ResponseError as e:
             e = self.substitute_known_error_reason(e)
             raise EFBMessageError(self._("Error from Web WeChat while sending file: [{code}] {message}")
                                   .format(code=e.err_code, message=e.err_msg))
 
-    def _bot_send_image(self, chat: wxpy.Chat, filename: str, file: IO[bytes]) -> wxpy.SentMessage:
+    def _bot_send_image(self, chat: wxpy.Chat, filename: str, file: IO[bytes],
+                        media_key: Optional[str] = None) -> wxpy.SentMessage:
+        upload = self._upload_once(chat, filename, file, 'image')
+
+        def send() -> wxpy.SentMessage:
+            return chat.send_image(filename, media_id=upload())
+
         try:
-            return chat.send_image(filename, file=file)
+            sent = self.send_scheduler.submit(chat, send)
         except wxpy.ResponseError as e:
             e = self.substitute_known_error_reason(e)
             raise EFBMessageError(self._("Error from Web WeChat while sending image: [{code}] {message}")
                                   .format(code=e.err_code, message=e.err_msg))
+        if media_key and sent.media_id:
+            self.media_cache.set_media_id(media_key, sent.media_id)
+        return sent
+
+    def _bot_send_cached_image(self, chat: wxpy.Chat, filename: str, media_key: str) -> Optional[wxpy.SentMessage]:
+        """
+        Send a picture uploaded before by its media ID, without uploading it again.
+
+        Returns:
+            The message sent, or ``None`` if the picture is to be uploaded,
+            as it was not uploaded before or its media ID is no longer accepted.
+        """
+        media_id = self.media_cache.get_media_id(media_key)
+        if not media_id:
+            return None
+        try:
+            return self.send_scheduler.submit(chat, lambda: chat.send_image(filename, media_id=media_id))
+        except wxpy.ResponseError as e:
+            self.logger.debug("Failed to send %s with cached media ID, uploading again: %s", filename, e)
+            self.media_cache.discard_media_id(media_key)
+            return None
 
     def _bot_send_video(self, chat: wxpy.Chat, filename: str, file: IO[bytes]) -> wxpy.SentMessage:
+        upload = self._upload_once(chat, filename, file, 'video')
+
+        def send() -> wxpy.SentMessage:
+            return chat.send_video(filename, media_id=upload())
+
         try:
-            return chat.send_video(filename, file=file)
+            return self.send_scheduler.submit(chat, send)
         except wxpy.ResponseError as e:
             e = self.substitute_known_error_reason(e)
             raise EFBMessageError(self._("Error from Web WeChat while sending video: [{code}] {message}")
@@ -782,4 +901,6 @@ class WeChatChannel(SlaveChannel):
         return err
 
     def get_message_by_id(self, chat: Chat, msg_id: MessageID) -> Optional['Message']:
-        raise EFBOperationNotSupported()
+        if not self.message_index.enabled:
+            raise EFBOperationNotSupported()
+        return self.message_index.get(chat, msg_id)
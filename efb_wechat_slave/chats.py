@@ -55,25 +55,31 @@ class ChatManager:
     def bot(self):
         return self.channel.bot
 
+    def get_chat_by_puid(self, uid: str) -> Optional[wxpy.Chat]:
+        """Find a chat by PUID, updating all chats once if it is not found.
+
+        The update is shared with concurrent lookups, and skipped if chats
+        were updated recently.
+        """
+        chat = self.bot.get_chat_by_puid(uid)
+        if chat is None and self.bot.update_chats():
+            chat = self.bot.get_chat_by_puid(uid)
+        return chat
+
     def get_wxpy_chat_by_uid(self, uid: str) -> wxpy.Chat:
         if uid in wxpy.Chat.SYSTEM_ACCOUNTS:
             return wxpy.Chat(wxpy.utils.wrap_user_name(uid), self.bot)
-        try:
-            return wxpy.ensure_one(self.bot.search(puid=uid))
-        except ValueError:
-            try:
-                self.bot.chats(update=True)
-                chat: wxpy.Chat = wxpy.ensure_one(self.bot.search(puid=uid))
-                return chat
-            except ValueError:
-                return wxpy.Chat(wxpy.utils.wrap_user_name(uid), self.bot)
+        chat = self.get_chat_by_puid(uid)
+        if chat is None:
+            return wxpy.Chat(wxpy.utils.wrap_user_name(uid), self.bot)
+        return chat
 
     @staticmethod
     def get_name_alias(chat: wxpy.Chat) -> Tuple[str, Optional[str]]:
-        chat_name = ews_utils.wechat_string_unescape(chat.nick_name)
+        chat_name = ews_utils.wechat_name_unescape(chat.nick_name)
         chat_alias = getattr(chat, 'display_name', None) or getattr(chat, 'remark_name', None)
         if chat_alias:
-            chat_alias = ews_utils.wechat_string_unescape(chat_alias)
+            chat_alias = ews_utils.wechat_name_unescape(chat_alias)
         # Remove alias if its same as chat name
         if chat_alias == chat_name:
             chat_alias = None
@@ -152,35 +158,32 @@ class ChatManager:
         return l
 
     def search_chat(self, uid: str, refresh: bool = False) -> Chat:
-        """Search chat by temporary UserName."""
-        try:
-            if refresh:
-                self.bot.chats(True)
-            if uid in wxpy.Chat.SYSTEM_ACCOUNTS:
-                chat: wxpy.Chat = wxpy.Chat(wxpy.utils.wrap_user_name(uid), self.bot)
-            else:
-                chat = wxpy.utils.ensure_one(self.bot.search(puid=uid))
-            return self.wxpy_chat_to_efb_chat(chat)
-        except ValueError:
-            if not refresh:
-                return self.search_chat(uid, refresh=True)
-            else:
-                raise EFBChatNotFound()
+        """Search chat by PUID.
+
+        Chats missing locally are fetched one by one, or else by
+        updating all chats. ``refresh`` updates all chats before searching.
+        All chats are not updated again if they were updated recently.
+        """
+        if refresh:
+            self.bot.update_chats()
+        if uid in wxpy.Chat.SYSTEM_ACCOUNTS:
+            chat: Optional[wxpy.Chat] = wxpy.Chat(wxpy.utils.wrap_user_name(uid), self.bot)
+        else:
+            chat = self.get_chat_by_puid(uid)
+        if chat is None:
+            raise EFBChatNotFound()
+        return self.wxpy_chat_to_efb_chat(chat)
 
     def search_member(self, uid: str, member_id: str, refresh: bool = False) -> Chat:
-        group = self.search_chat(uid)
+        if refresh:
+            self.bot.update_chats()
+        group = self.get_chat_by_puid(uid)
         if not isinstance(group, wxpy.Group):
             raise EFBChatNotFound()
-        try:
-            if refresh:
-                self.bot.chats(True)
-            chat: wxpy.Chat = wxpy.utils.ensure_one(group.search(puid=member_id))
-            return self.wxpy_chat_to_efb_chat(chat)
-        except ValueError:
-            if not refresh:
-                return self.search_chat(uid, refresh=True)
-            else:
-                raise EFBChatNotFound()
+        member = group.get_member_by_puid(member_id)
+        if member is None:
+            raise EFBChatNotFound()
+        return self.wxpy_chat_to_efb_chat(member)
 
     # Constants extracted from Web WC source, see EWS#27.
     CONTACT_FLAG_CONTACT = 1
@@ -0,0 +1,130 @@
+# coding: utf-8
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Generic, Optional, TypeVar
+
+from .vendor.wxpy.utils import MetricsRegistry
+
+V = TypeVar("V")
+
+
+class ExpiringIndex(Generic[V]):
+    """
+    Mapping from string keys to values that are forgotten after ``ttl``
+    seconds, holding at most ``max_size`` entries.
+
+    Entries are kept in the order they were last set, which is also the
+    order they expire in, so that lookups, updates and removal of expired
+    or excess entries all take constant time.
+
+    If a ``path`` is given, entries not yet expired are saved there as JSON
+    with :meth:`dump`, and loaded again on creation.
+    """
+
+    def __init__(self, ttl: float, max_size: int, path: Optional[Path] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Any]' = OrderedDict()
+        self.counters: Counter = Counter()
+        if path is not None:
+            self.load()
+
+    def _purge(self, now: float):
+        while self.entries:
+            key, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at > now:
+                break
+            del self.entries[key]
+            self.counters['expired'] += 1
+
+    def __setitem__(self, key: str, value: V):
+        now = time.time()
+        with self.lock:
+            self._purge(now)
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters['evicted'] += 1
+
+    def get(self, key: str, default: Optional[V] = None) -> Optional[V]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                return default
+            return entry[1]
+
+    def pop(self, key: str, default: Optional[V] = None) -> Optional[V]:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                return default
+            return entry[1]
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def __delitem__(self, key: str):
+        with self.lock:
+            del self.entries[key]
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._purge(time.time())
+            return len(self.entries)
+
+    def metrics(self) -> Dict[str, int]:
+        """Number of entries, and of entries expired or evicted for exceeding the size so far."""
+        return dict(self.counters, size=len(self))
+
+    def register_metrics(self, registry: MetricsRegistry, name: str):
+        """Report :meth:`metrics` as gauges to a metrics registry."""
+        for key in ('size', 'expired', 'evicted'):
+            registry.gauge(name, lambda key=key: self.metrics().get(key, 0), stat=key)
+
+    def dump(self):
+        """Save entries not yet expired to ``path``."""
+        if self.path is None:
+            return
+        with self.lock:
+            self._purge(time.time())
+            data = [[key, expires_at, value] for key, (expires_at, value) in self.entries.items()]
+        # Write to a temporary file first, so that the last dump is kept if interrupted
+        temp_path = str(self.path) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, str(self.path))
+        self.logger.debug("Saved %s entries to %s", len(data), self.path)
+
+    def load(self):
+        """Load entries not yet expired from ``path``."""
+        try:
+            with open(str(self.path)) as f:
+                data = json.load(f)
+            entries = sorted(((str(key), float(expires_at), value) for key, expires_at, value in data),
+                             key=lambda i: i[1])
+        except FileNotFoundError:
+            return
+        except (TypeError, ValueError):
+            # Not JSON, or not a list of entries as written by dump()
+            self.logger.warning("Ignored invalid index at %s", self.path)
+            return
+        now = time.time()
+        with self.lock:
+            for key, expires_at, value in entries:
+                if expires_at > now:
+                    self.entries[key] = (expires_at, value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        self.logger.debug("Loaded %s entries from %s", len(self.entries), self.path)
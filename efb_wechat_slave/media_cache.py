@@ -0,0 +1,140 @@
+# coding: utf-8
+
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Callable, IO, Iterator, Optional
+
+from .media_converter import EXTENSIONS
+
+
+class MediaCache:
+    """
+    Content-addressed cache of pictures sent to WeChat.
+
+    Entries are keyed by the hash of the source picture and the format it
+    is converted to. Converted pictures are kept on disk up to ``max_size``
+    bytes, least recently used ones are removed first. Media IDs returned
+    by WeChat on upload are kept in memory until the next login, so that
+    the same picture can be sent again without uploading it.
+    """
+
+    MAX_MEDIA_IDS = 1024
+
+    def __init__(self, path: Path, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.media_ids: 'OrderedDict[str, str]' = OrderedDict()
+        self.size: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def key(data: bytes, mime: Optional[str]) -> str:
+        """
+        Key of a picture converted to ``mime``, also used as its file name.
+
+        The extension is kept, as WeChat tells stickers from pictures by
+        the extension of the file name.
+        """
+        extension = EXTENSIONS.get(mime or "") or mimetypes.guess_extension(mime or "") or ""
+        return hashlib.sha256(data).hexdigest() + extension
+
+    @contextmanager
+    def open(self, key: str, create: Callable[[str], int]) -> Iterator[IO[bytes]]:
+        """
+        Open a converted picture, converting it on a cache miss.
+
+        Args:
+            key: Key from :meth:`key`
+            create: Function writing the converted picture to the path
+                given, returning its size
+
+        Yields:
+            The converted picture opened for reading.
+        """
+        if not self.enabled:
+            with NamedTemporaryFile(suffix=os.path.splitext(key)[1]) as temp_file:
+                create(temp_file.name)
+                yield temp_file
+            return
+        path = self.path / key
+        try:
+            f = path.open('rb')
+            # Modification time marks the last use, for eviction
+            os.utime(str(path))
+        except FileNotFoundError:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(dir=str(self.path), suffix=".tmp", delete=False) as temp:
+                temp_path = temp.name
+            try:
+                size = create(temp_path)
+                os.replace(temp_path, str(path))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            f = path.open('rb')
+            self._added(size)
+        with f:
+            yield f
+
+    def _added(self, size: int):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(i.stat().st_size for i in self._entries())
+            else:
+                self.size += size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _entries(self) -> Iterator[os.DirEntry]:
+        return (i for i in os.scandir(str(self.path))
+                if i.is_file() and not i.name.endswith(".tmp"))
+
+    def _evict(self):
+        """Remove least recently used pictures until the cache fits in ``max_size``."""
+        entries = sorted(self._entries(), key=lambda i: i.stat().st_mtime)
+        self.size = sum(i.stat().st_size for i in entries)
+        for entry in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            self.logger.debug("Removed %s from media cache", entry.name)
+
+    def get_media_id(self, key: str) -> Optional[str]:
+        with self.lock:
+            media_id = self.media_ids.get(key)
+            if media_id is not None:
+                self.media_ids.move_to_end(key)
+            return media_id
+
+    def set_media_id(self, key: str, media_id: str):
+        with self.lock:
+            self.media_ids[key] = media_id
+            self.media_ids.move_to_end(key)
+            if len(self.media_ids) > self.MAX_MEDIA_IDS:
+                self.media_ids.popitem(last=False)
+
+    def discard_media_id(self, key: str):
+        with self.lock:
+            self.media_ids.pop(key, None)
+
+    def clear_media_ids(self):
+        """Forget all media IDs, as they are not valid after logging in again."""
+        with self.lock:
+            self.media_ids.clear()
@@ -0,0 +1,267 @@
+# coding: utf-8
+
+import io
+import logging
+import math
+import sys
+import threading
+from concurrent.futures import Executor
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Type, cast
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# PIL and multiprocessing are imported in the functions using them, as they are
+# slow to import and only needed once a picture is converted.
+
+# Pixels with alpha up to 128 become transparent in GIF, others opaque.
+#: Lookup table from alpha to the mask of transparent pixels, used with ``Image.point``
+TRANSPARENCY_MASK_LUT: List[int] = [255 if a <= 128 else 0 for a in range(256)]
+#: Palette index of the transparent colour in converted GIF, quantized colours use the rest
+TRANSPARENT_INDEX = 255
+#: Duration of a frame in milliseconds when the source does not specify one
+DEFAULT_FRAME_DURATION = 100
+#: Qualities tried in turn to recompress a JPEG larger than the size limit
+JPEG_QUALITIES = (85, 75, 60, 45)
+#: Estimated size in bytes of a pixel in JPEG, to pick the scale of large pictures before decoding them
+JPEG_BYTES_PER_PIXEL = 0.35
+#: Times to scale down a picture that is still larger than the size limit
+FIT_ATTEMPTS = 4
+#: Target a bit below the size limit, as the estimated scale is not exact
+FIT_MARGIN = 0.9
+
+
+def _pil_enums() -> Tuple['Type[Image.Quantize]', 'Type[Image.Dither]', 'Type[Image.Resampling]']:
+    """``Quantize``, ``Dither`` and ``Resampling`` enums of Pillow."""
+    from PIL import Image
+    if not hasattr(Image, 'Resampling'):
+        # Before Pillow 9.1, the same constants are attributes of the module
+        return cast(Any, Image), cast(Any, Image), cast(Any, Image)
+    return Image.Quantize, Image.Dither, Image.Resampling
+
+
+def _quantize(frame: 'Image.Image', palette: Optional['Image.Image'] = None) -> 'Image.Image':
+    Quantize, Dither, _ = _pil_enums()
+    mask = frame.getchannel('A').point(TRANSPARENCY_MASK_LUT)
+    if palette is None:
+        # Fast octree is several times faster than the median cut of the adaptive palette
+        frame = frame.convert('RGB').quantize(colors=TRANSPARENT_INDEX, method=Quantize.FASTOCTREE)
+    else:
+        frame = frame.convert('RGB').quantize(palette=palette, dither=Dither.NONE)
+    frame.paste(TRANSPARENT_INDEX, mask)
+    return frame
+
+
+def _write_gif(frames: List['Image.Image'], durations: List[int], loop: int, f: IO[bytes]):
+    from PIL import Image
+    Quantize, _, _ = _pil_enums()
+    if len(frames) > 1:
+        # Pick the palette from all frames at once, stacked vertically and
+        # scaled down so that the strip is about the size of one frame
+        factor = max(1, int(math.sqrt(len(frames))))
+        samples = [frame.convert('RGB').reduce(factor) for frame in frames]
+        width, height = samples[0].size
+        strip = Image.new('RGB', (width, height * len(samples)))
+        for i, sample in enumerate(samples):
+            strip.paste(sample, (0, height * i))
+        palette = strip.quantize(colors=TRANSPARENT_INDEX, method=Quantize.FASTOCTREE)
+        frames = [_quantize(frame, palette) for frame in frames]
+        frames[0].save(f, format='GIF', save_all=True, append_images=frames[1:],
+                       duration=durations, loop=loop, disposal=2, transparency=TRANSPARENT_INDEX)
+    else:
+        _quantize(frames[0]).save(f, format='GIF', transparency=TRANSPARENT_INDEX)
+
+
+def _fitting_scale(size: int, max_size: int) -> float:
+    # Encoded size grows about linearly with the number of pixels
+    return math.sqrt(max_size / size) * FIT_MARGIN
+
+
+def convert_to_gif(data: bytes, path: str, max_size: Optional[int] = None) -> int:
+    """
+    Convert an image, animated or not, to GIF with binary transparency.
+
+    All frames share one palette, so that the transparent colour stays the
+    same through the animation. GIFs larger than ``max_size`` are scaled
+    down to fit, at most :data:`FIT_ATTEMPTS` times.
+
+    Args:
+        data: Content of the source image
+        path: Path to write the GIF to
+        max_size: Maximum size of the GIF in bytes
+
+    Returns:
+        Size of the GIF in bytes.
+    """
+    from PIL import Image, ImageSequence
+    _, _, Resampling = _pil_enums()
+    img = Image.open(io.BytesIO(data))
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(img):
+        durations.append(frame.info.get('duration') or DEFAULT_FRAME_DURATION)
+        frames.append(frame.convert('RGBA'))
+    loop = img.info.get('loop', 0)
+    with open(path, 'wb') as f:
+        scaled = frames
+        for _ in range(FIT_ATTEMPTS):
+            f.seek(0)
+            f.truncate()
+            _write_gif(scaled, durations, loop, f)
+            size = f.tell()
+            if not max_size or size <= max_size:
+                break
+            scale = _fitting_scale(size, max_size) * scaled[0].width / frames[0].width
+            target = (max(1, int(frames[0].width * scale)), max(1, int(frames[0].height * scale)))
+            scaled = [frame.resize(target, Resampling.LANCZOS) for frame in frames]
+        return size
+
+
+def _flatten(img: 'Image.Image') -> 'Image.Image':
+    """Put a picture on a white background."""
+    from PIL import Image
+    img = img.convert('RGBA')
+    return Image.alpha_composite(Image.new('RGBA', img.size, (255, 255, 255, 255)), img).convert('RGB')
+
+
+def convert_to_jpeg(data: bytes, path: str, max_size: Optional[int] = None) -> int:
+    """
+    Convert the first frame of an image to JPEG on a white background.
+
+    With ``max_size``, the JPEG is recompressed with lower quality, and then
+    scaled down, until it fits. The initial scale is estimated from the
+    dimensions in the header, and JPEG sources are decoded at a reduced
+    scale where possible instead of decoding them in full.
+
+    Args:
+        data: Content of the source image
+        path: Path to write the JPEG to
+        max_size: Maximum size of the JPEG in bytes
+
+    Returns:
+        Size of the JPEG in bytes.
+    """
+    from PIL import Image, ImageOps
+    _, _, Resampling = _pil_enums()
+    img = Image.open(io.BytesIO(data))
+    if not max_size:
+        out = _flatten(img)
+        with open(path, 'wb') as f:
+            out.save(f, format='JPEG')
+            return f.tell()
+
+    width, height = img.size
+    scale = min(1.0, _fitting_scale(int(width * height * JPEG_BYTES_PER_PIXEL) or 1, max_size))
+    buffer = io.BytesIO()
+    for _ in range(FIT_ATTEMPTS):
+        source = Image.open(io.BytesIO(data))
+        # Decodes JPEG at a fraction of the full size directly, when scaled down enough
+        source.thumbnail((max(1, int(width * scale)), max(1, int(height * scale))), Resampling.LANCZOS)
+        # Photos taken on phones are often rotated by EXIF, which is not kept
+        out = _flatten(ImageOps.exif_transpose(source))
+        for quality in JPEG_QUALITIES:
+            buffer.seek(0)
+            buffer.truncate()
+            out.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= max_size:
+                break
+        else:
+            scale *= _fitting_scale(buffer.tell(), max_size)
+            continue
+        break
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+        return f.tell()
+
+
+CONVERTERS: Dict[str, Callable[[bytes, str, Optional[int]], int]] = {
+    'image/gif': convert_to_gif,
+    'image/jpeg': convert_to_jpeg,
+}
+
+#: File name extensions of converted pictures, WeChat sends files named ``.gif`` as stickers
+EXTENSIONS: Dict[str, str] = {
+    'image/gif': '.gif',
+    'image/jpeg': '.jpg',
+}
+
+
+class ConversionError(Exception):
+    """Raised when a picture cannot be converted, as it is not a picture Pillow can decode."""
+
+
+class MediaConverter:
+    """
+    Convert pictures to be sent to WeChat in a pool of worker processes,
+    so that image processing does not hold up other threads of the channel.
+
+    Worker processes are started on the first conversion and kept until
+    :meth:`stop`. With no worker, pictures are converted in the calling thread.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        with self.lock:
+            if self.executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                if sys.version_info >= (3, 7):
+                    # Forking a process with running threads may copy held locks
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def convert(self, mime: str, data: bytes, path: str, max_size: Optional[int] = None) -> int:
+        """
+        Convert a picture, blocking until it is done.
+
+        Args:
+            mime: MIME type to convert to, a key of :data:`CONVERTERS`
+            data: Content of the source picture
+            path: Path to write the converted picture to
+            max_size: Size in bytes to scale down or recompress the picture to
+
+        Returns:
+            Size of the converted picture in bytes, which may still exceed
+            ``max_size`` if the picture could not be made small enough.
+
+        Raises:
+            ConversionError: The source could not be decoded or converted.
+        """
+        converter = CONVERTERS[mime]
+        try:
+            if self.workers <= 0:
+                return converter(data, path, max_size)
+            return self._convert_in_worker(converter, data, path, max_size)
+        except ConversionError:
+            raise
+        except Exception as e:
+            # Pillow raises all sorts of errors on corrupted or unsupported pictures
+            raise ConversionError("Failed to convert picture to %s: %r" % (mime, e)) from e
+
+    def _convert_in_worker(self, converter: Callable[[bytes, str, Optional[int]], int],
+                           data: bytes, path: str, max_size: Optional[int]) -> int:
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self._get_executor()
+        try:
+            return executor.submit(converter, data, path, max_size).result()
+        except BrokenProcessPool:
+            self.logger.warning("Media conversion worker exited unexpectedly, converting in this thread.")
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False)
+            return converter(data, path, max_size)
+
+    def stop(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,224 @@
+# coding: utf-8
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from ehforwarderbot import Chat, Message, MsgType, coordinator
+from ehforwarderbot.types import MessageID
+
+from .vendor.wxpy.utils import MetricsRegistry
+
+Row = Tuple[Any, ...]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    uid TEXT PRIMARY KEY,
+    chat TEXT NOT NULL,
+    author TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    text TEXT NOT NULL,
+    path TEXT,
+    mime TEXT,
+    filename TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+"""
+
+
+class MessageIndex:
+    """
+    Index of messages sent and received by the channel, stored in SQLite.
+
+    Messages are written in batches by a background thread, at most
+    ``flush_interval`` seconds after they are added, and looked up by ID
+    from the batch waiting to be written or from the database. Messages
+    older than ``max_age`` seconds, and the oldest ones past ``max_count``,
+    are removed from time to time. If the database cannot be written, at
+    most ``MAX_PENDING`` messages wait for the next attempt, and the oldest
+    ones are dropped beyond that.
+
+    Only what is needed to rebuild a message is kept: its chat, author,
+    type, time, text, and the path of its file if it was saved locally.
+    """
+
+    FLUSH_INTERVAL = 1.0
+    BATCH_SIZE = 500
+    MAX_PENDING = 10000
+    PRUNE_INTERVAL = 10 * 60
+
+    def __init__(self, path: Path, max_count: int, max_age: float,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.max_count = max_count
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+        self.pending: 'OrderedDict[str, Row]' = OrderedDict()
+        self.pending_lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.db: Optional[sqlite3.Connection] = None
+        self.last_prune = 0.0
+        self.dropped = 0
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_count > 0
+
+    def start(self):
+        """Open the database and start writing messages in the background."""
+        if not self.enabled or self._thread is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Used from the writer thread and from threads looking up messages,
+        # always under ``db_lock``.
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        # Write-ahead log commits a batch without rewriting pages in place,
+        # and only syncs the log at checkpoints.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.prune()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="EWS message index writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Write pending messages and close the database."""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        thread.join()
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+            self.db = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # noinspection PyBroadException
+            try:
+                self.flush()
+                if time.time() - self.last_prune >= self.PRUNE_INTERVAL:
+                    self.prune()
+            except Exception:
+                self.logger.exception("Failed to write message index to %s", self.path)
+
+    def add(self, msg: Message):
+        """Add a message with its ID assigned to the index."""
+        if not self.enabled or not msg.uid or not msg.chat or not msg.author:
+            return
+        path = str(msg.path) if msg.path else None
+        row = (msg.uid, msg.chat.uid, msg.author.uid, msg.author.name, msg.type.value,
+               time.time(), msg.text or "", path, msg.mime, msg.filename)
+        with self.pending_lock:
+            self.pending[msg.uid] = row
+            if len(self.pending) > self.MAX_PENDING:
+                # Writes keep failing, drop the oldest instead of growing without bound
+                self.pending.popitem(last=False)
+                if not self.dropped:
+                    self.logger.warning("Message index %s cannot be written, dropping oldest messages.",
+                                        self.path)
+                self.dropped += 1
+            if len(self.pending) >= self.BATCH_SIZE:
+                self._wake.set()
+
+    def flush(self):
+        """Write messages added so far to the database."""
+        with self.pending_lock:
+            rows = list(self.pending.values())
+        if not rows:
+            return
+        with self.db_lock:
+            if self.db is None:
+                return
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        with self.pending_lock:
+            # Keep messages added again while writing, to be written next time
+            for row in rows:
+                if self.pending.get(row[0]) is row:
+                    del self.pending[row[0]]
+        self.logger.debug("Wrote %s messages to index", len(rows))
+
+    def prune(self):
+        """Remove messages older than ``max_age``, and the oldest past ``max_count``."""
+        self.last_prune = time.time()
+        with self.db_lock:
+            if self.db is None:
+                return
+            with self.db:
+                self.db.execute("BEGIN")
+                removed = self.db.execute("DELETE FROM messages WHERE timestamp < ?",
+                                          (self.last_prune - self.max_age,)).rowcount
+                # Time of the oldest message to keep, found along the timestamp index
+                removed += self.db.execute(
+                    "DELETE FROM messages WHERE timestamp < "
+                    "(SELECT timestamp FROM messages ORDER BY timestamp DESC LIMIT 1 OFFSET ?)",
+                    (self.max_count - 1,)).rowcount
+        if removed:
+            self.logger.debug("Removed %s messages from index", removed)
+
+    def lookup(self, msg_id: MessageID) -> Optional[Row]:
+        """Row of a message by its ID, if it is indexed."""
+        with self.pending_lock:
+            row = self.pending.get(msg_id)
+        if row is not None:
+            return row
+        with self.db_lock:
+            if self.db is None:
+                return None
+            return self.db.execute("SELECT * FROM messages WHERE uid = ?", (msg_id,)).fetchone()
+
+    def get(self, chat: Chat, msg_id: MessageID) -> Optional[Message]:
+        """
+        Rebuild a message from the index.
+
+        Args:
+            chat: Chat the message was sent to
+            msg_id: ID of the message
+
+        Returns:
+            The message, or ``None`` if it is not indexed in ``chat``.
+            Its file is attached only if it is still found at the saved path.
+        """
+        row = self.lookup(msg_id)
+        if row is None:
+            return None
+        uid, chat_uid, author_uid, author_name, msg_type, _, text, path, mime, filename = row
+        if chat_uid != chat.uid:
+            return None
+        try:
+            author = chat.get_member(author_uid)
+        except KeyError:
+            author = chat.add_member(uid=author_uid, name=author_name)
+        msg = Message(
+            chat=chat, author=author, type=MsgType(msg_type), text=text, uid=MessageID(uid),
+            deliver_to=coordinator.master,
+        )
+        if path and os.path.exists(path):
+            msg.path, msg.mime, msg.filename = Path(path), mime, filename
+            msg.file = open(path, 'rb')
+        return msg
+
+    def register_metrics(self, registry: MetricsRegistry):
+        """Report the number of messages waiting to be written, and dropped, as gauges."""
+        registry.gauge('message_index_pending', lambda: len(self.pending))
+        registry.gauge('message_index_dropped', lambda: self.dropped)
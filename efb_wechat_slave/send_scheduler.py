@@ -0,0 +1,192 @@
+# coding: utf-8
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Dict, Optional, TypeVar
+
+from ehforwarderbot.exceptions import EFBMessageError
+
+from .vendor import wxpy
+from .vendor.wxpy.utils import MetricsRegistry
+
+if TYPE_CHECKING:
+    from . import WeChatChannel
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``rate`` tokens per second, holding
+    at most ``capacity`` tokens. A rate of 0 or below disables the limit,
+    the bucket can still be held back by :meth:`penalize`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.last_update = time.monotonic()
+        # Time until which a bucket with no limit is held back
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token, going into debt if necessary.
+
+        Returns:
+            float: Seconds to wait before the token can be used.
+        """
+        if self.rate <= 0:
+            return max(0.0, self.blocked_until - time.monotonic())
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+            self.last_update = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def penalize(self, seconds: float):
+        """Hold the bucket empty for another ``seconds``, e.g. after being throttled."""
+        with self.lock:
+            if self.rate <= 0:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            else:
+                self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class SendScheduler:
+    """
+    Schedule outbound messages to Web WeChat.
+
+    Every send goes through a global token bucket and one per chat, sends
+    to the same chat are kept in order, and sends throttled by the server
+    (error 1205) are retried with exponential backoff. The number of sends
+    waiting or in progress is bounded, extra sends are rejected right away.
+    """
+
+    THROTTLED_ERROR_CODE = 1205
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 30.0
+
+    def __init__(self, channel: 'WeChatChannel'):
+        self.channel = channel
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+        # Flags are defined per minute
+        self.global_rate: float = channel.flag('send_rate_limit') / 60
+        self.chat_rate: float = channel.flag('send_chat_rate_limit') / 60
+        self.burst: int = channel.flag('send_burst_size')
+        self.max_retries: int = channel.flag('send_retry_attempts')
+        self.queue_size: int = channel.flag('send_queue_size')
+
+        self.global_bucket = TokenBucket(self.global_rate, self.burst)
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+        self.chat_locks: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.queue_size) if self.queue_size > 0 else None
+
+        self.counters: Counter = Counter()
+        self.pending = 0
+        self.max_wait = 0.0
+        self.registry: Optional[MetricsRegistry] = None
+
+    def _get_chat_state(self, key: str):
+        with self.lock:
+            if key not in self.chat_buckets:
+                self.chat_buckets[key] = TokenBucket(self.chat_rate, self.burst)
+                self.chat_locks[key] = threading.Lock()
+            return self.chat_buckets[key], self.chat_locks[key]
+
+    def _count(self, key: str):
+        # Sends are made from several threads
+        with self.lock:
+            self.counters[key] += 1
+
+    def submit(self, chat: wxpy.Chat, send: Callable[[], T]) -> T:
+        """
+        Send a message to a chat under the rate limits, blocking until it is sent.
+
+        Args:
+            chat: The chat to send to
+            send: Function that sends the message once, may be called
+                again on retry.
+
+        Returns:
+            Whatever ``send`` returns.
+
+        Raises:
+            EFBMessageError: When too many messages are waiting to be sent.
+            wxpy.ResponseError: When Web WeChat rejected the message, or
+                kept throttling after all retries.
+        """
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            self._count('rejected')
+            raise EFBMessageError(self.channel._("Too many messages are waiting to be sent. "
+                                                 "Please try again later."))
+        with self.lock:
+            self.counters['submitted'] += 1
+            self.pending += 1
+        registry = self.registry
+        if registry is not None:
+            started = time.perf_counter()
+        try:
+            bucket, chat_lock = self._get_chat_state(chat.user_name)
+            with chat_lock:
+                return self._send(chat, bucket, send)
+        finally:
+            with self.lock:
+                self.pending -= 1
+            if self.slots is not None:
+                self.slots.release()
+            if registry is not None:
+                registry.since('send', started)
+
+    def _send(self, chat: wxpy.Chat, bucket: TokenBucket, send: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            wait = max(self.global_bucket.reserve(), bucket.reserve())
+            if wait > 0:
+                with self.lock:
+                    self.counters['delayed'] += 1
+                    self.max_wait = max(self.max_wait, wait)
+                self.logger.debug("Delaying message to %s for %.2f s to stay under rate limit.", chat, wait)
+                time.sleep(wait)
+            try:
+                result = send()
+            except wxpy.ResponseError as e:
+                if e.err_code != self.THROTTLED_ERROR_CODE or attempt >= self.max_retries:
+                    self._count('failed')
+                    raise
+                delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                attempt += 1
+                self._count('retried')
+                self.logger.warning("Web WeChat throttled message to %s, retrying in %.2f s (%d/%d).",
+                                    chat, delay, attempt, self.max_retries)
+                bucket.penalize(delay)
+                self.global_bucket.penalize(delay)
+            else:
+                self._count('sent')
+                return result
+
+    def metrics(self) -> Dict[str, float]:
+        """Snapshot of counters and current queue state."""
+        with self.lock:
+            metrics: Dict[str, float] = dict(self.counters)
+        metrics['pending'] = self.pending
+        metrics['max_wait'] = self.max_wait
+        metrics['queue_size'] = self.queue_size
+        return metrics
+
+    def register_metrics(self, registry: MetricsRegistry):
+        """Report time taken by each send, and :meth:`metrics` as gauges, to a metrics registry."""
+        self.registry = registry
+        for key in ('submitted', 'sent', 'delayed', 'retried', 'failed', 'rejected', 'pending', 'max_wait'):
+            registry.gauge('send_scheduler', lambda key=key: self.metrics().get(key, 0), stat=key)
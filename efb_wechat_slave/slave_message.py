@@ -5,17 +5,17 @@ import logging
 import re
 import tempfile
 import threading
+import time
 import uuid
 from pathlib import Path
-from typing import TYPE_CHECKING, Callable, Optional, Tuple, Dict, BinaryIO
+from typing import TYPE_CHECKING, Callable, Optional, Tuple, BinaryIO
 from xml.etree import ElementTree as ETree
 from xml.etree.ElementTree import Element
 
-import magic
 import requests
-from PIL import Image
 
 from ehforwarderbot import Message, MsgType, Chat, coordinator
+from ehforwarderbot import utils as efb_utils
 from ehforwarderbot.chat import ChatMember, SystemChatMember
 from ehforwarderbot.message import LocationAttribute, LinkAttribute, MessageCommands, MessageCommand, \
     Substitutions
@@ -23,7 +23,9 @@ from ehforwarderbot.status import MessageRemoval, ChatUpdates
 from ehforwarderbot.types import MessageID
 from . import constants
 from . import utils as ews_utils
+from .expiring_index import ExpiringIndex
 from .vendor import wxpy
+from .vendor.itchat.components.messages import USELESS_PRODUCED_MSG_TYPES
 from .vendor.wxpy.api import consts
 
 if TYPE_CHECKING:
@@ -31,6 +33,15 @@ if TYPE_CHECKING:
 
 
 class SlaveMessageManager:
+    # Raw MsgType of audio and video calls
+    CALL_MSG_TYPES = (50, 52, 53)
+    # Raw MsgType dropped before they are wrapped as wxpy messages:
+    # those itchat produces as useless messages, except calls
+    IGNORED_MSG_TYPES = USELESS_PRODUCED_MSG_TYPES - set(CALL_MSG_TYPES)
+    # Seconds to wait for WeChat to echo a recall made from the master channel
+    RECALL_ECHO_TTL = 24 * 60 * 60
+    RECALL_ECHO_MAX_SIZE = 10000
+
     UNSUPPORTED_MSG_PROMPT = (
         'This type of message is not supported on Web WeChat. View it on your phone.',
         'このタイプのメッセージはWeChatではサポートされていません。あなたの電話で見る。',
@@ -48,8 +59,12 @@ class SlaveMessageManager:
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.wechat_msg_register()
         self.file_download_mutex_lock = threading.Lock()
-        # Message ID: [JSON ID, remaining count]
-        self.recall_msg_id_conversion: Dict[str, Tuple[str, int]] = dict()
+        # Message ID: [JSON ID, remaining count], of messages recalled from the master
+        # channel, to drop the recall notice echoed back by WeChat
+        self.recall_msg_id_conversion: ExpiringIndex[Tuple[str, int]] = ExpiringIndex(
+            ttl=self.RECALL_ECHO_TTL, max_size=self.RECALL_ECHO_MAX_SIZE,
+            path=efb_utils.get_data_path(self.channel.channel_id) / "recall_msg_id_conversion.json"
+        )
 
     def get_chat_and_author(self, msg: wxpy.Message) -> Tuple[Chat, ChatMember]:
         chat = self.channel.chats.wxpy_chat_to_efb_chat(msg.chat)
@@ -72,6 +87,10 @@ class SlaveMessageManager:
                 logger = logging.getLogger(__name__)
                 logger.debug("[%s] Raw message: %r", msg.id, msg.raw)
 
+                metrics = self.channel.metrics
+                if metrics is not None:
+                    started = time.perf_counter()
+
                 efb_msg: Optional[Message] = func(self, msg, *args, **kwargs)
 
                 if efb_msg is None:
@@ -97,7 +116,13 @@ class SlaveMessageManager:
 
                 logger.debug("[%s] Chat: %s, Author: %s", efb_msg.uid, efb_msg.chat, efb_msg.author)
 
+                if metrics is not None:
+                    metrics.since('convert', started)
+                    started = time.perf_counter()
                 coordinator.send_message(efb_msg)
+                if metrics is not None:
+                    metrics.since('send_message', started)
+                self.channel.message_index.add(efb_msg)
                 if efb_msg.file:
                     efb_msg.file.close()
 
@@ -121,10 +146,9 @@ class SlaveMessageManager:
         self.bot.register(except_self=False, msg_types=consts.FRIENDS)(self.wechat_friend_msg)
         self.bot.register(except_self=False, msg_types=consts.NOTE)(self.wechat_system_msg)
         self.bot.register(except_self=False, msg_types=consts.UNSUPPORTED)(self.wechat_system_unsupported_msg)
-
-        @self.bot.register(msg_types=consts.SYSTEM)
-        def wc_msg_system_log(msg):
-            self.logger.debug("WeChat System Message:\n%s", repr(msg))
+        # Only calls are reported among messages unsupported by wxpy,
+        # drop the rest before they are wrapped as wxpy messages.
+        self.bot.ignored_msg_types.update(self.IGNORED_MSG_TYPES)
 
     @Decorators.wechat_msg_meta
     def wechat_text_msg(self, msg: wxpy.Message) -> Optional[Message]:
@@ -160,7 +184,7 @@ class SlaveMessageManager:
 
     @Decorators.wechat_msg_meta
     def wechat_system_unsupported_msg(self, msg: wxpy.Message) -> Optional[Message]:
-        if msg.raw['MsgType'] in (50, 52, 53):
+        if msg.raw['MsgType'] in self.CALL_MSG_TYPES:
             text = self._("[Incoming audio/video call, please check your phone.]")
         else:
             return None
@@ -199,9 +223,8 @@ class SlaveMessageManager:
         if msg.recalled_message_id:
             recall_id = str(msg.recalled_message_id)
             # check conversion table first
-            if recall_id in self.recall_msg_id_conversion:
+            if self.recall_msg_id_conversion.pop(recall_id) is not None:
                 # prevent feedback of messages deleted by master channel.
-                del self.recall_msg_id_conversion[recall_id]
                 return None
                 # val = self.recall_msg_id_conversion.pop(recall_id)
                 # val[1] -= 1
@@ -262,7 +285,9 @@ class SlaveMessageManager:
                 return self.wechat_unsupported_msg(msg)
             else:
                 try:
-                    xml = ETree.fromstring(msg.raw.get('Content'))
+                    xml = msg.content_xml
+                    if xml is None:
+                        raise ValueError()
                     appmsg_type = self.get_node_text(xml, './appmsg/type', "")
                     source = self.get_node_text(xml, './appinfo/appname', "")
                     if appmsg_type == '2':  # Image
@@ -315,8 +340,8 @@ class SlaveMessageManager:
     @Decorators.wechat_msg_meta
     def wechat_shared_link_msg(self, msg: wxpy.Message, source: str, title: str, des: str, url: str) -> Message:
         share_mode = self.channel.flag('app_shared_link_mode')
-        xml = ETree.fromstring(msg.raw.get('Content'))
-        thumb_url = self.get_node_text(xml, ".//thumburl", "")
+        xml = msg.content_xml
+        thumb_url = self.get_node_text(xml, ".//thumburl", "") if xml is not None else ""
         via = self._("Via {source}").format(source=source) if source else ""
         if thumb_url:
             return self.wechat_raw_link_msg(msg, title, des, thumb_url, url)
@@ -372,7 +397,9 @@ class SlaveMessageManager:
         return efb_msg
 
     def wechat_newsapp_msg(self, msg: wxpy.Message) -> Optional[Message]:
-        xml = ETree.fromstring(msg.raw.get('Content'))
+        xml = msg.content_xml
+        if xml is None:
+            return self.wechat_unsupported_msg(msg)
         news = xml.findall('.//category/item')
         e_msg = None
         if news:
@@ -418,8 +445,10 @@ class SlaveMessageManager:
             efb_msg.path, efb_msg.mime, efb_msg.file = self.save_file(msg)
             efb_msg.filename = msg.file_name
             # ^ Also throws EOFError
-            if 'gif' in efb_msg.mime and Image.open(efb_msg.path).is_animated:
-                efb_msg.type = MsgType.Animation
+            if 'gif' in efb_msg.mime:
+                from PIL import Image
+                if Image.open(efb_msg.path).is_animated:
+                    efb_msg.type = MsgType.Animation
             efb_msg.text = ""
         except EOFError:
             efb_msg.text += self._("[Failed to download the sticker, please check your phone.]")
@@ -521,6 +550,9 @@ class SlaveMessageManager:
             File path, MIME, File
         """
         file: BinaryIO = tempfile.NamedTemporaryFile()  # type: ignore
+        metrics = self.channel.metrics
+        if metrics is not None:
+            started = time.perf_counter()
         try:
             if msg.type in [consts.ATTACHMENT, consts.VIDEO]:
                 with self.file_download_mutex_lock:
@@ -543,11 +575,14 @@ class SlaveMessageManager:
                     file.write(block)
             else:
                 raise e
+        if metrics is not None:
+            metrics.since('save_file', started)
         if file.seek(0, 2) <= 0:
             raise EOFError('File downloaded is Empty')
         else:
             self.logger.debug("[%s] File size: %s", msg.id, file.seek(0, 2))
         file.seek(0)
+        import magic
         mime = magic.from_file(file.name, mime=True)
         if isinstance(mime, bytes):
             mime = mime.decode()
@@ -3,6 +3,7 @@ import base64
 import io
 import os
 import json
+from functools import lru_cache
 from typing import Dict, Any, TYPE_CHECKING, List
 
 from ehforwarderbot.types import MessageID
@@ -139,6 +140,25 @@ class ExperimentalFlagsManager:
         'user_agent': None,
         'text_post_processing': True,
         'replace_emoticon': True,
+        'send_rate_limit': 0,
+        'send_chat_rate_limit': 0,
+        'send_burst_size': 5,
+        'send_retry_attempts': 3,
+        'send_queue_size': 100,
+        'mark_as_read_interval': 5,
+        'metrics_sink': "off",
+        'metrics_path': None,
+        'metrics_interval': 60,
+        'adaptive_poll_timeouts': True,
+        'sync_check_timeout': 30,
+        'webwx_sync_timeout': 20,
+        'poll_backoff_max': 15,
+        'poll_retry_attempts': 5,
+        'chat_refresh_interval': 60,
+        'media_conversion_workers': 1,
+        'media_cache_size': 100,
+        'message_index_size': 100000,
+        'message_index_days': 30,
     }
 
     def __init__(self, channel: 'WeChatChannel'):
@@ -171,6 +191,24 @@ def wechat_string_unescape(content: str, replace_emoticon: bool = True) -> str:
     return d['Content']
 
 
+@lru_cache(maxsize=8192)
+def wechat_name_unescape(content: str, replace_emoticon: bool = True) -> str:
+    """
+    Unescape a WeChat HTML string used as a chat or member name.
+
+    Names rarely change across calls, so results are memoized in a bounded
+    cache keyed by the raw string and ``replace_emoticon``.
+
+    Args:
+        content (str): String to be formatted
+        replace_emoticon (bool): Convert WeChat emoticons to emoji
+
+    Returns:
+        str: Unescaped string.
+    """
+    return wechat_string_unescape(content, replace_emoticon)
+
+
 def generate_message_uid(messages: List[wxpy.SentMessage]) -> MessageID:
     return MessageID(json.dumps(
         [[message.chat.puid, message.id, message.local_id]
@@ -1,17 +1,19 @@
 from gettext import translation
 from io import StringIO
 
-import cjkwrap
-from bullet import YesNo, Numbers, Bullet, Check
 from pkg_resources import resource_filename
-from ruamel.yaml import YAML
 
 from ehforwarderbot import coordinator, utils
 from ehforwarderbot.types import ModuleID
 from . import WeChatChannel
 
+# The EFB wizard loads the wizard of every module installed on start,
+# dependencies (cjkwrap, bullet and ruamel.yaml) are imported only when
+# this one is run.
+
 
 def print_wrapped(text):
+    import cjkwrap
     paras = text.split("\n")
     for i in paras:
         print(*cjkwrap.wrap(i), sep="\n")
@@ -36,6 +38,7 @@ class DataModel:
         if instance_id:
             self.channel_id = ModuleID(self.channel_id + "#" + instance_id)
         self.config_path = utils.get_config_path(self.channel_id)
+        from ruamel.yaml import YAML
         self.yaml = YAML()
         if not self.config_path.exists():
             self.build_default_config()
@@ -154,10 +157,127 @@ flags_settings = {
          _('Replace the emoticon in WeChat to emoji. If disabled, the '
            'emoticon will be shown as text in square brackets. Enabled by default.'
            )),
+    "send_rate_limit":
+        (0, 'int', None,
+         _('Maximum number of messages sent to WeChat per minute across all '
+           'chats. Messages over the limit are delayed. Set to 0 to disable, '
+           'messages are then only delayed when WeChat reports that they are '
+           'sent too fast (error 1205). Disabled by default.'
+           )),
+    "send_chat_rate_limit":
+        (0, 'int', None,
+         _('Maximum number of messages sent to WeChat per minute to each '
+           'chat. Messages over the limit are delayed. Set to 0 to disable. '
+           'Disabled by default.'
+           )),
+    "send_burst_size":
+        (5, 'int', None,
+         _('Number of messages that can be sent at once before rate limits '
+           'take effect.'
+           )),
+    "send_retry_attempts":
+        (3, 'int', None,
+         _('Number of times to retry sending a message when WeChat reports '
+           'that messages are sent too fast (error 1205).'
+           )),
+    "send_queue_size":
+        (100, 'int', None,
+         _('Maximum number of messages waiting to be sent to WeChat. '
+           'Messages beyond this limit fail immediately. Set to 0 to disable.'
+           )),
+    "mark_as_read_interval":
+        (5, 'int', None,
+         _('Seconds to wait before marking the same chat as read again. '
+           'Chats are only marked as read when new messages arrived since '
+           'they were last read. Set to 0 to disable the wait.'
+           )),
+    "metrics_sink":
+        ("off", 'choices', ['off', 'registry', 'log', 'prometheus'],
+         _('Collect timing of each stage of the message pipeline, message '
+           'counts, queue depth, threads and cache sizes. Options: "off" to '
+           'disable, "registry" to keep metrics in memory only, "log" to '
+           'write a summary to the log, "prometheus" to write a Prometheus '
+           'text file.'
+           )),
+    "metrics_path":
+        (None, 'str', None,
+         _('Path of the Prometheus text file when metrics_sink is '
+           '"prometheus". Leave undefined to use metrics.prom in the data '
+           'folder of EWS.'
+           )),
+    "metrics_interval":
+        (60, 'int', None,
+         _('Seconds between exports of metrics. Set to 0 to disable periodic '
+           'exports.'
+           )),
+    "adaptive_poll_timeouts":
+        (True, 'bool', None,
+         _('Adjust timeouts of receiving messages from WeChat to the '
+           'observed round trip time, so that dead connections are detected '
+           'sooner. If disabled, the maximum timeouts below are always used.'
+           )),
+    "sync_check_timeout":
+        (30, 'int', None,
+         _('Maximum seconds to wait for WeChat to answer a long polling '
+           'request (synccheck). WeChat holds such a request for about 25 '
+           'seconds when there is no new message.'
+           )),
+    "webwx_sync_timeout":
+        (20, 'int', None,
+         _('Maximum seconds to wait for WeChat to send new messages '
+           '(webwxsync).'
+           )),
+    "poll_backoff_max":
+        (15, 'int', None,
+         _('Maximum seconds to wait before retrying to receive messages '
+           'after a network error. Retries wait exponentially longer with '
+           'random jitter, up to this limit.'
+           )),
+    "poll_retry_attempts":
+        (5, 'int', None,
+         _('Number of consecutive network errors while receiving messages '
+           'before EWS considers itself logged out.'
+           )),
+    "chat_refresh_interval":
+        (60, 'int', None,
+         _('Minimum seconds between two refreshes of the full chat list from '
+           'WeChat. Requests to refresh within this time use the chats '
+           'already loaded, unless requested from the chat list command. '
+           'Chats missing locally are still fetched one by one. Set to 0 to '
+           'disable the limit.'
+           )),
+    "media_conversion_workers":
+        (1, 'int', None,
+         _('Number of worker processes converting stickers and GIFs before '
+           'they are sent to WeChat. Worker processes are started when the '
+           'first picture is converted. Set to 0 to convert in the sending '
+           'thread instead.'
+           )),
+    "media_cache_size":
+        (100, 'int', None,
+         _('Maximum size in MiB of converted stickers and GIFs kept on disk, '
+           'so that they are not converted again when sent again. Least '
+           'recently sent ones are removed first. Pictures sent again in the '
+           'same session are not uploaded again either. Set to 0 to disable '
+           'the cache.'
+           )),
+    "message_index_size":
+        (100000, 'int', None,
+         _('Maximum number of messages kept in the local message index, used '
+           'to look up messages sent and received by their IDs, e.g. to '
+           'resolve quotes and edits. Oldest messages are removed first. '
+           'The index stores the text of messages in plain text on disk. Set '
+           'to 0 to disable the index.'
+           )),
+    "message_index_days":
+        (30, 'int', None,
+         _('Number of days messages are kept in the local message index.'
+           )),
 }
 
 
 def setup_experimental_flags(data):
+    from bullet import YesNo, Numbers, Bullet, Check
     print_wrapped(_(
         "EWS does not require any configuration, you only need to scan "
         "a QR code when you start up EH Forwarder Bot. It’s as simple as "
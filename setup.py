@@ -12,7 +12,8 @@ tests_require = ["pytest", "mypy"]
 
 setup(
     name='efb-wechat-slave',
-    packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests"]),
+    packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests",
+                                    "benchmarks.*", "benchmarks"]),
     version=__version__,
     description='WeChat Slave Channel for EH Forwarder Bot, based on WeChat Web API.',
     long_description=long_description,
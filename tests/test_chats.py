@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from efb_wechat_slave.chats import ChatManager
+
+
+class RefreshingBot:
+    """Bot with a chat known only after all chats are updated."""
+
+    def __init__(self, updated=True):
+        self.chats = {}
+        self.updated = updated
+        self.updates = 0
+
+    def get_chat_by_puid(self, puid, update=True):
+        return self.chats.get(puid)
+
+    def update_chats(self, force=False):
+        self.updates += 1
+        self.chats["puid"] = SimpleNamespace(puid="puid")
+        return self.updated
+
+
+def make_manager(bot):
+    manager = ChatManager.__new__(ChatManager)
+    manager.channel = SimpleNamespace(bot=bot)
+    return manager
+
+
+def test_get_chat_by_puid_updates_chats_on_miss():
+    bot = RefreshingBot()
+    manager = make_manager(bot)
+    assert manager.get_wxpy_chat_by_uid("puid") is bot.chats["puid"]
+    assert bot.updates == 1
+    # Found without updating again
+    assert manager.get_chat_by_puid("puid") is bot.chats["puid"]
+    assert bot.updates == 1
+
+
+def test_get_chat_by_puid_skips_lookup_when_not_updated():
+    bot = RefreshingBot(updated=False)
+    manager = make_manager(bot)
+    assert manager.get_chat_by_puid("puid") is None
+    assert bot.updates == 1
@@ -0,0 +1,58 @@
+from unittest import mock
+
+from efb_wechat_slave.expiring_index import ExpiringIndex
+from efb_wechat_slave.vendor.wxpy.utils import MetricsRegistry
+
+
+def test_expiring_index_forgets_expired_entries():
+    index = ExpiringIndex(ttl=10, max_size=10)
+    with mock.patch("time.time", return_value=100):
+        index["a"] = 1
+    with mock.patch("time.time", return_value=105):
+        index["b"] = 2
+        assert index.get("a") == 1
+        assert "b" in index
+    with mock.patch("time.time", return_value=110):
+        assert index.get("a") is None
+        assert len(index) == 1
+        assert index.pop("b") == 2
+        assert index.pop("b") is None
+    assert index.metrics() == {"size": 0, "expired": 1}
+
+
+def test_expiring_index_evicts_oldest_entries():
+    index = ExpiringIndex(ttl=60, max_size=2)
+    for key in "abc":
+        index[key] = key
+    index["b"] = "b"
+    index["d"] = "d"
+    assert "a" not in index and "c" not in index
+    assert index.get("b") == "b" and index.get("d") == "d"
+    assert index.metrics() == {"size": 2, "evicted": 2}
+
+    metrics = MetricsRegistry()
+    index.register_metrics(metrics, "index")
+    gauges = metrics.collect()["gauges"]
+    assert gauges[("index", (("stat", "evicted"),))] == 2
+    assert gauges[("index", (("stat", "size"),))] == 2
+
+
+def test_expiring_index_persists_entries(tmp_path):
+    path = tmp_path / "index.json"
+    index = ExpiringIndex(ttl=60, max_size=10, path=path)
+    index["a"] = ["msg", 2]
+    with mock.patch("time.time", return_value=0):
+        index["expired"] = ["msg", 1]
+    index.dump()
+
+    loaded = ExpiringIndex(ttl=60, max_size=10, path=path)
+    assert loaded.get("a") == ["msg", 2]
+    assert "expired" not in loaded
+    assert len(loaded) == 1
+
+
+def test_expiring_index_ignores_invalid_file(tmp_path):
+    path = tmp_path / "index.json"
+    for content in ("{", "{}", '{"key": 1}', "[1]", '[["key", 1]]', '[["key", "soon", 1]]', "1"):
+        path.write_text(content)
+        assert len(ExpiringIndex(ttl=60, max_size=10, path=path)) == 0
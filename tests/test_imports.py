@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+# Loaded on first use, not when EFB imports the channel or its wizard
+DEFERRED = ("PIL", "magic", "pyqrcode", "yaml", "bullet", "cjkwrap", "ruamel.yaml", "multiprocessing")
+
+
+def imported_modules(module):
+    code = "import sys\nbefore = set(sys.modules)\nimport {}\nprint(' '.join(set(sys.modules) - before))".format(module)
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True).stdout
+    return set(output.split())
+
+
+def test_heavy_dependencies_are_imported_on_first_use():
+    for module in ("efb_wechat_slave", "efb_wechat_slave.wizard"):
+        assert not imported_modules(module) & set(DEFERRED), module
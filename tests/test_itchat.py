@@ -0,0 +1,262 @@
+import json
+import pickle
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from efb_wechat_slave.vendor.itchat.components import messages
+from efb_wechat_slave.vendor.itchat.components.contact import update_local_chatrooms, update_local_friends
+from efb_wechat_slave.vendor.itchat.core import Core
+from efb_wechat_slave.vendor.itchat.poll import PollController
+from efb_wechat_slave.vendor.itchat.storage.templates import ContactList, User
+from efb_wechat_slave.vendor.itchat.utils import search_dict_list
+
+
+def test_poll_controller_follows_round_trip_time():
+    controller = PollController(syncCheckTimeout=30, webwxSyncTimeout=20)
+    assert controller.sync_check_timeout()[1] == 30
+
+    for _ in range(20):
+        controller.observe_rtt(0.1)
+        controller.observe_hold(10)
+    connect, read = controller.sync_check_timeout()
+    assert connect == controller.MIN_CONNECT_TIMEOUT
+    assert controller.hold < 12
+    assert read == pytest.approx(controller.hold + controller.rto + controller.HOLD_MARGIN)
+    assert controller.webwx_sync_timeout()[1] == controller.MIN_READ_TIMEOUT
+
+    # A held request timing out means the server holds longer than estimated.
+    controller.on_timeout()
+    assert controller.sync_check_timeout()[1] > read
+
+
+def test_poll_controller_fixed_timeouts_when_not_adaptive():
+    controller = PollController(adaptive=False, connectTimeout=10, syncCheckTimeout=30, webwxSyncTimeout=20)
+    controller.observe_rtt(0.1)
+    assert controller.sync_check_timeout() == (10, 30)
+    assert controller.webwx_sync_timeout() == (10, 20)
+
+
+def test_poll_controller_backoff_is_jittered_and_bounded():
+    controller = PollController(backoffMax=4)
+    delays = [controller.on_failure() for _ in range(6)]
+    assert 0.5 <= delays[0] <= 1
+    assert 1 <= delays[1] <= 2
+    assert all(delay <= 4 for delay in delays)
+    assert controller.failures == 6
+    controller.on_success()
+    assert controller.failures == 0
+
+
+def test_contact_list_indexes_user_names():
+    contacts = ContactList()
+    for i in range(3):
+        contacts.append({"UserName": "@%d" % i, "NickName": str(i)})
+    assert contacts.get_by_user_name("@1")["NickName"] == "1"
+    assert search_dict_list(contacts, "UserName", "@2") is contacts[2]
+
+    contacts.append({"UserName": "@3"})
+    assert contacts.get_by_user_name("@3") is contacts[3]
+
+    del contacts[:]
+    contacts.append({"UserName": "@4"})
+    assert contacts.get_by_user_name("@1") is None
+    assert contacts.get_by_user_name("@4") is contacts[0]
+
+
+class PagedContactSession:
+    """Serve webwxgetcontact in pages of two contacts."""
+
+    def __init__(self, contacts):
+        self.contacts = contacts
+        self.requested = []
+
+    def get(self, url, **kwargs):
+        seq = int(parse_qs(urlsplit(url).query)["seq"][0])
+        self.requested.append(seq)
+        page = self.contacts[seq:seq + 2]
+        next_seq = seq + 2 if seq + 2 < len(self.contacts) else 0
+        return SimpleNamespace(content=json.dumps({"MemberList": page, "Seq": next_seq}).encode())
+
+
+def test_get_contact_merges_pages_as_they_arrive():
+    core = Core()
+    core.loginInfo = {"url": "https://wx.qq.com", "skey": "@crypt", "wxuin": "1",
+                      "User": {"UserName": "@self", "NickName": "self"}}
+    core.storageClass.userName = "@self"
+    contacts = [{"UserName": "@friend%d" % i, "NickName": "friend", "Sex": 1, "VerifyFlag": 0}
+                for i in range(4)]
+    contacts.append({"UserName": "@@group", "NickName": "group", "Sex": 0, "MemberList": []})
+    core.s = PagedContactSession(contacts)
+
+    progress = []
+    chatrooms = core.get_contact(
+        update=True, progressCallback=lambda loaded, done: progress.append((loaded, done, len(core.memberList))))
+
+    assert core.s.requested == [0, 2, 4]
+    # Friends of a page are merged before the callback of that page
+    assert progress == [(2, False, 2), (4, False, 4), (5, True, 4)]
+    assert [c["UserName"] for c in chatrooms] == ["@@group"]
+    assert core.memberList.get_by_user_name("@friend3")["NickName"] == "friend"
+
+
+def test_contact_records_store_only_values_set():
+    core = Core()
+    core.loginInfo = {"wxuin": "1", "User": User({"UserName": "@self", "NickName": "self"})}
+    core.storageClass.userName = "@self"
+    member = {"UserName": "@member", "NickName": "member", "DisplayName": "", "Uin": 0, "MemberStatus": 0}
+    update_local_chatrooms(core, [
+        {"UserName": "@@group", "NickName": "group", "Sex": 0, "Statues": 1, "MemberList": [member]},
+        {"UserName": "@@empty", "NickName": "empty", "MemberList": []},
+    ])
+
+    group = core.chatroomList.get_by_user_name("@@group")
+    stored = group["MemberList"][0]
+    assert sorted(stored) == ["MemberList", "MemberStatus", "NickName", "UserName"]
+    # Values of the template are read back when not stored
+    assert stored["DisplayName"] == "" and stored.get("Uin") == 0 and stored.displayName == ""
+    # Values of the template are not listed as stored keys
+    assert "DisplayName" not in stored and "Uin" not in stored and len(stored) == 4
+    assert set(dict(stored)) == set(stored.keys()) == {"MemberList", "MemberStatus", "NickName", "UserName"}
+    assert json.loads(json.dumps(stored)) == dict(stored)
+    assert "Sex" not in group and group["Statues"] == 1
+    assert stored.get("ChatRoomOwner") is None
+    with pytest.raises(KeyError):
+        stored["ChatRoomOwner"]
+    assert stored.chatroom is group
+
+    # Chatrooms without self as a member share the login user
+    assert core.chatroomList.get_by_user_name("@@empty")["Self"] is core.loginInfo["User"]
+    assert group["Self"] is core.loginInfo["User"]
+
+    storage = pickle.loads(pickle.dumps(core.storageClass.dumps()))
+    core.storageClass.loads(storage)
+    group = core.chatroomList.get_by_user_name("@@group")
+    assert group["MemberList"][0].chatroom is group
+    assert group["Self"] is core.chatroomList.get_by_user_name("@@empty")["Self"]
+
+
+def test_update_local_chatrooms_reports_member_changes():
+    core = Core()
+    core.loginInfo = {"wxuin": "1", "User": User({"UserName": "@self", "NickName": "self"})}
+    core.storageClass.userName = "@self"
+    members = [{"UserName": "@%s" % i, "NickName": i} for i in ("a", "b", "c")]
+    result = update_local_chatrooms(core, [{"UserName": "@@group", "NickName": "group", "MemberList": members}])
+    assert result["MemberChanges"] == {"@@group": {"Added": ["@a", "@b", "@c"], "Removed": [], "Changed": []}}
+
+    members = [{"UserName": "@b", "NickName": "b2"}, {"UserName": "@c", "NickName": "c"},
+               {"UserName": "@d", "NickName": "d"}]
+    result = update_local_chatrooms(core, [{"UserName": "@@group", "NickName": "group", "MemberList": members}])
+    assert result["MemberChanges"] == {"@@group": {"Added": ["@d"], "Removed": ["@a"], "Changed": ["@b"]}}
+
+    member_list = core.chatroomList.get_by_user_name("@@group")["MemberList"]
+    assert [m["UserName"] for m in member_list] == ["@b", "@c", "@d"]
+    assert member_list.get_by_user_name("@a") is None
+    assert member_list.get_by_user_name("@b")["NickName"] == "b2"
+    assert member_list.get_by_user_name("@d").chatroom["UserName"] == "@@group"
+
+    # Nothing to report when members are the same, or not listed
+    result = update_local_chatrooms(core, [{"UserName": "@@group", "NickName": "group", "MemberList": members}])
+    assert result["MemberChanges"] == {}
+    result = update_local_chatrooms(core, [{"UserName": "@@group", "NickName": "group", "MemberList": []}])
+    assert result["MemberChanges"] == {}
+    assert len(member_list) == 3
+
+
+def make_message_core():
+    core = Core()
+    core.loginInfo = {"url": "https://wx.qq.com", "fileUrl": "https://file.wx.qq.com", "skey": "@crypt",
+                      "wxuin": "1", "User": User({"UserName": "@self", "NickName": "self"})}
+    core.storageClass.userName = "@self"
+    core.s.cookies.set("webwx_data_ticket", "ticket")
+    return core
+
+
+def raw_message(msg_type, content="", **kwargs):
+    return dict({"MsgId": "1", "NewMsgId": 1, "MsgType": msg_type, "FromUserName": "@friend",
+                 "ToUserName": "@self", "Content": content, "Url": "", "FileName": "", "MediaId": "",
+                 "AppMsgType": 0, "Status": 3, "StatusNotifyUserName": "", "Ticket": "",
+                 "RecommendInfo": {"UserName": "@stranger", "NickName": "stranger"}}, **kwargs)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (raw_message(1, "hello &amp; bye"), {"Type": "Text", "Text": "hello & bye"}),
+    (raw_message(1, "Park (Street):<br/>/cgi-bin/map", Url="https://map"), {"Type": "Map", "Text": "Park (Street)"}),
+    (raw_message(1, "no location", Url="https://map"), {"Type": "Map", "Text": "Map"}),
+    (raw_message(3), {"Type": "Picture", "FileName": "png"}),
+    (raw_message(47), {"Type": "Sticker", "FileName": "gif"}),
+    (raw_message(34), {"Type": "Recording", "FileName": "mp3"}),
+    (raw_message(42), {"Type": "Card", "Text": {"UserName": "@stranger", "NickName": "stranger"}}),
+    (raw_message(43), {"Type": "Video", "FileName": "mp4"}),
+    (raw_message(62), {"Type": "Video", "FileName": "mp4"}),
+    (raw_message(49, "history", AppMsgType=0), {"Type": "Note", "Text": "history"}),
+    (raw_message(49, FileName="report.pdf", AppMsgType=6, MediaId="@media"), {"Type": "Attachment"}),
+    (raw_message(49, AppMsgType=8), {"Type": "Picture", "FileName": "gif"}),
+    (raw_message(49, FileName="note", AppMsgType=17), {"Type": "Note", "Text": "note"}),
+    (raw_message(49, "<![CDATA[Transfer]]><des><![CDATA[Received 1.00\u3002More]]>", AppMsgType=2000),
+     {"Type": "Note", "Text": "Received 1.00"}),
+    (raw_message(49, "<msg/>", AppMsgType=2000),
+     {"Type": "Note", "Text": "You may found detailed info in Content key."}),
+    (raw_message(49, FileName="Link title", AppMsgType=5), {"Type": "Sharing", "Text": "Link title"}),
+    (raw_message(49, FileName="Song", AppMsgType=3), {"Type": "Sharing", "Text": "Song"}),
+    (raw_message(49, FileName="Mini program", AppMsgType=33), {"Type": "Sharing", "Text": "Mini program"}),
+    (raw_message(51), {"Type": "Useless", "Text": "UselessMsg"}),
+    (raw_message(10000, "You recalled a message"), {"Type": "Note", "Text": "You recalled a message"}),
+    (raw_message(10002, "<sysmsg><![CDATA[Alice recalled a message]]></sysmsg>"),
+     {"Type": "Note", "Text": "Alice recalled a message"}),
+    (raw_message(10002, "<sysmsg/>"), {"Type": "Note", "Text": "System message"}),
+    (raw_message(40), {"Type": "Useless", "Text": "UselessMsg"}),
+    (raw_message(12345), {"Type": "Useless", "Text": "UselessMsg"}),
+])
+def test_produce_msg_by_type(raw, expected):
+    msg, = messages.produce_msg(make_message_core(), [dict(raw)])
+    for key, value in expected.items():
+        if key == "FileName":
+            # File names are prefixed by the time of the batch
+            assert msg[key].endswith("." + value)
+        else:
+            assert msg[key] == value
+    if msg["Type"] in ("Picture", "Sticker", "Recording", "Video", "Attachment"):
+        assert callable(msg["Text"])
+
+
+def test_produce_msg_friends_and_phone_init():
+    core = make_message_core()
+    update_local_friends(core, [{"UserName": "@friend", "NickName": "friend", "Uin": 0, "VerifyFlag": 0}])
+
+    msg, = messages.produce_msg(core, [raw_message(37, Ticket="ticket")])
+    assert msg["Type"] == "Friends"
+    assert msg["Text"]["userName"] == "@stranger" and msg["Text"]["verifyContent"] == "ticket"
+    assert msg["User"].verifyDict is msg["Text"]
+
+    msg, = messages.produce_msg(core, [raw_message(
+        51, "<msg><username>wxid_friend,filehelper</username></msg>", StatusNotifyUserName="@friend,filehelper")])
+    assert msg["Type"] == "System" and msg["SystemInfo"] == "uins"
+    assert msg["Text"] == ["@friend"]
+    assert core.memberList.get_by_user_name("@friend")["Uin"] == "wxid_friend"
+
+
+def test_produce_msg_names_files_of_a_batch_alike(monkeypatch):
+    formatted = []
+    real_strftime = messages.time.strftime
+
+    def strftime(fmt, t=None):
+        formatted.append(fmt)
+        return real_strftime(fmt, t)
+
+    monkeypatch.setattr(messages.time, "strftime", strftime)
+    batch = messages.produce_msg(make_message_core(), [raw_message(3), raw_message(34), raw_message(1, "text")])
+    assert batch[0]["FileName"][:-len("png")] == batch[1]["FileName"][:-len("mp3")]
+    # The time is formatted once per batch, and not for batches without files
+    assert len(formatted) == 1
+    messages.produce_msg(make_message_core(), [raw_message(1, "text")])
+    assert len(formatted) == 1
+
+
+def test_msg_producers_cover_useless_types():
+    for msg_type in messages.USELESS_MSG_TYPES:
+        assert msg_type in messages.MSG_PRODUCERS
+    assert 43 not in messages.USELESS_PRODUCED_MSG_TYPES
+    assert messages.USELESS_PRODUCED_MSG_TYPES == {40, 50, 52, 53, 9999}
+    assert set(messages.APP_MSG_PRODUCERS) == {0, 6, 8, 17, 2000}
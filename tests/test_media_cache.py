@@ -0,0 +1,72 @@
+import os
+
+from efb_wechat_slave.media_cache import MediaCache
+
+
+def writer(content, calls):
+    def create(path):
+        calls.append(path)
+        with open(path, "wb") as f:
+            f.write(content)
+        return len(content)
+    return create
+
+
+def test_media_cache_converts_once(tmp_path):
+    cache = MediaCache(tmp_path, 1024)
+    key = cache.key(b"sticker", "image/gif")
+    assert key.endswith(".gif")
+    assert key == cache.key(b"sticker", "image/gif") != cache.key(b"sticker", "image/jpeg")
+
+    calls = []
+    for _ in range(2):
+        with cache.open(key, writer(b"converted", calls)) as f:
+            assert f.read() == b"converted"
+            assert f.name.endswith(key)
+    assert len(calls) == 1
+    assert os.listdir(str(tmp_path)) == [key]
+
+
+def test_media_cache_evicts_least_recently_used(tmp_path):
+    cache = MediaCache(tmp_path, 250)
+    keys = [cache.key(bytes([i]), "image/jpeg") for i in range(3)]
+    calls = []
+    for i, key in enumerate(keys):
+        with cache.open(key, writer(b"x" * 100, calls)):
+            pass
+        # Modification times may be too coarse to tell the order otherwise
+        os.utime(str(tmp_path / key), (i, i))
+    assert sorted(os.listdir(str(tmp_path))) == sorted(keys[1:])
+
+    with cache.open(keys[1], writer(b"", calls)):
+        pass
+    with cache.open(keys[0], writer(b"x" * 100, calls)):
+        pass
+    assert sorted(os.listdir(str(tmp_path))) == sorted(keys[:2])
+    assert len(calls) == 4
+
+
+def test_media_cache_disabled_converts_every_time(tmp_path):
+    cache = MediaCache(tmp_path / "cache", 0)
+    key = cache.key(b"sticker", "image/gif")
+    calls = []
+    for _ in range(2):
+        with cache.open(key, writer(b"converted", calls)) as f:
+            assert f.name.endswith(".gif")
+            assert f.read() == b"converted"
+    assert len(calls) == 2
+    assert not (tmp_path / "cache").exists()
+
+
+def test_media_cache_keeps_recent_media_ids(tmp_path):
+    cache = MediaCache(tmp_path, 1024)
+    cache.MAX_MEDIA_IDS = 2
+    cache.set_media_id("a", "@media_a")
+    cache.set_media_id("b", "@media_b")
+    assert cache.get_media_id("a") == "@media_a"
+    cache.set_media_id("c", "@media_c")
+    assert cache.get_media_id("b") is None
+    cache.discard_media_id("a")
+    assert cache.get_media_id("a") is None
+    cache.clear_media_ids()
+    assert cache.get_media_id("c") is None
@@ -0,0 +1,116 @@
+import io
+
+import pytest
+from PIL import Image
+
+from efb_wechat_slave.media_converter import ConversionError, MediaConverter, convert_to_gif, convert_to_jpeg
+
+
+def make_sticker(frames=1, size=(64, 64)):
+    images = []
+    for i in range(frames):
+        img = Image.new("RGBA", size, (0, 0, 0, 0))
+        # Opaque square moving along the diagonal
+        img.paste((200, 40 * i % 256, 80, 255), (i * 4, i * 4, i * 4 + 32, i * 4 + 32))
+        images.append(img)
+    return images
+
+
+def encode(images, format="WEBP"):
+    buffer = io.BytesIO()
+    if len(images) > 1:
+        images[0].save(buffer, format=format, save_all=True, append_images=images[1:], duration=50, lossless=True)
+    else:
+        images[0].save(buffer, format=format, lossless=True)
+    return buffer.getvalue()
+
+
+def test_convert_to_gif_keeps_transparency(tmp_path):
+    path = tmp_path / "sticker.gif"
+    size = convert_to_gif(encode(make_sticker()), str(path))
+    assert size == path.stat().st_size
+
+    gif = Image.open(path)
+    assert gif.format == "GIF"
+    rgba = gif.convert("RGBA")
+    assert rgba.getpixel((60, 60))[3] == 0
+    assert rgba.getpixel((10, 10))[:3] == (200, 0, 80)
+
+
+def test_convert_to_gif_keeps_all_frames(tmp_path):
+    path = tmp_path / "animated.gif"
+    convert_to_gif(encode(make_sticker(frames=5), format="PNG"), str(path))
+
+    gif = Image.open(path)
+    assert gif.n_frames == 5
+    gif.seek(4)
+    assert gif.info["duration"] == 50
+    rgba = gif.convert("RGBA")
+    assert rgba.getpixel((20, 20))[3] == 255
+    assert rgba.getpixel((2, 2))[3] == 0
+
+
+def test_convert_to_jpeg_on_white(tmp_path):
+    path = tmp_path / "sticker.jpg"
+    MediaConverter(workers=0).convert("image/jpeg", encode(make_sticker()), str(path))
+
+    jpeg = Image.open(path)
+    assert jpeg.format == "JPEG"
+    assert all(c > 245 for c in jpeg.getpixel((60, 60)))
+
+
+def test_media_converter_uses_worker_processes(tmp_path):
+    converter = MediaConverter(workers=1)
+    try:
+        path = tmp_path / "sticker.gif"
+        assert converter.convert("image/gif", encode(make_sticker(frames=2)), str(path)) == path.stat().st_size
+        assert converter.executor is not None
+    finally:
+        converter.stop()
+    assert converter.executor is None
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_media_converter_raises_conversion_error(tmp_path, workers):
+    converter = MediaConverter(workers=workers)
+    try:
+        with pytest.raises(ConversionError):
+            converter.convert("image/jpeg", b"not a picture", str(tmp_path / "photo.jpg"))
+    finally:
+        converter.stop()
+
+
+def test_convert_to_jpeg_fits_in_max_size(tmp_path):
+    noise = Image.effect_noise((1200, 900), 60).convert("RGB")
+    buffer = io.BytesIO()
+    noise.save(buffer, format="PNG")
+    data = buffer.getvalue()
+
+    path = tmp_path / "photo.jpg"
+    size = convert_to_jpeg(data, str(path), max_size=100 * 1024)
+    assert size == path.stat().st_size <= 100 * 1024
+    jpeg = Image.open(path)
+    assert jpeg.width < 1200
+    assert jpeg.width / jpeg.height == pytest.approx(4 / 3, rel=0.01)
+
+
+def test_convert_to_jpeg_applies_exif_orientation(tmp_path):
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    Image.new("RGB", (400, 200), "red").save(buffer, format="JPEG", exif=exif)
+
+    path = tmp_path / "photo.jpg"
+    convert_to_jpeg(buffer.getvalue(), str(path), max_size=10 * 1024 * 1024)
+    assert Image.open(path).size == (200, 400)
+
+
+def test_convert_to_gif_scales_down_to_max_size(tmp_path):
+    frames = [Image.effect_noise((300, 300), 80).convert("RGBA") for _ in range(3)]
+    path = tmp_path / "animated.gif"
+    size = convert_to_gif(encode(frames, format="PNG"), str(path), max_size=80 * 1024)
+
+    assert size == path.stat().st_size <= 80 * 1024
+    gif = Image.open(path)
+    assert gif.n_frames == 3
+    assert gif.width < 300
@@ -0,0 +1,96 @@
+from unittest import mock
+
+import pytest
+from ehforwarderbot import Message, MsgType, coordinator
+from ehforwarderbot.chat import GroupChat
+from ehforwarderbot.types import MessageID
+
+from efb_wechat_slave.message_index import MessageIndex
+
+
+@pytest.fixture(autouse=True)
+def master(monkeypatch):
+    # Messages rebuilt from the index are delivered to the master channel
+    monkeypatch.setattr(coordinator, "master", mock.Mock(), raising=False)
+
+
+def make_chat(uid="group"):
+    chat = GroupChat(module_id="test", module_name="Test", uid=uid, name="Group")
+    chat.add_member(uid="alice", name="Alice")
+    return chat
+
+
+def make_message(chat, uid, text="text", **kwargs):
+    return Message(chat=chat, author=chat.get_member("alice"), type=MsgType.Text,
+                   text=text, uid=MessageID(uid), **kwargs)
+
+
+def test_message_index_finds_pending_and_written_messages(tmp_path):
+    chat = make_chat()
+    index = MessageIndex(tmp_path / "messages.db", 100, 3600, flush_interval=60)
+    index.start()
+    try:
+        index.add(make_message(chat, "1", "pending"))
+        msg = index.get(chat, MessageID("1"))
+        assert msg.text == "pending" and msg.author.uid == "alice" and msg.type == MsgType.Text
+
+        index.flush()
+        assert not index.pending
+        assert index.get(chat, MessageID("1")).text == "pending"
+        assert index.get(make_chat("other"), MessageID("1")) is None
+        assert index.get(chat, MessageID("2")) is None
+    finally:
+        index.stop()
+
+
+def test_message_index_persists_and_prunes(tmp_path):
+    chat = make_chat()
+    index = MessageIndex(tmp_path / "messages.db", 2, 3600)
+    index.start()
+    with mock.patch("time.time", return_value=0):
+        index.add(make_message(chat, "expired"))
+    for i in range(3):
+        with mock.patch("time.time", return_value=10 ** 10 + i):
+            index.add(make_message(chat, str(i)))
+    index.stop()
+
+    index = MessageIndex(tmp_path / "messages.db", 2, 3600)
+    with mock.patch("time.time", return_value=10 ** 10):
+        index.start()
+    try:
+        assert index.get(chat, MessageID("expired")) is None
+        assert index.get(chat, MessageID("0")) is None
+        assert index.get(chat, MessageID("1")).text == "text"
+        assert index.get(chat, MessageID("2")).text == "text"
+    finally:
+        index.stop()
+
+
+def test_message_index_attaches_existing_file(tmp_path):
+    chat = make_chat()
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"image")
+    index = MessageIndex(tmp_path / "messages.db", 100, 3600)
+    index.start()
+    try:
+        index.add(make_message(chat, "1", path=path, mime="image/jpeg", filename="image.jpg"))
+        msg = index.get(chat, MessageID("1"))
+        with msg.file:
+            assert msg.file.read() == b"image"
+        assert msg.mime == "image/jpeg" and msg.filename == "image.jpg"
+
+        path.unlink()
+        assert index.get(chat, MessageID("1")).file is None
+    finally:
+        index.stop()
+
+
+def test_message_index_drops_oldest_pending_messages(tmp_path):
+    chat = make_chat()
+    # Not started, so nothing is written
+    index = MessageIndex(tmp_path / "messages.db", 100, 3600)
+    index.MAX_PENDING = 3
+    for i in range(5):
+        index.add(make_message(chat, str(i)))
+    assert list(index.pending) == ["2", "3", "4"]
+    assert index.dropped == 2
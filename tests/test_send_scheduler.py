@@ -0,0 +1,115 @@
+import io
+import time
+from types import SimpleNamespace
+
+import pytest
+from ehforwarderbot.exceptions import EFBMessageError
+
+from efb_wechat_slave.send_scheduler import SendScheduler, TokenBucket
+from efb_wechat_slave.utils import ExperimentalFlagsManager
+from efb_wechat_slave.vendor.wxpy import ResponseError
+
+
+def make_scheduler(**flags):
+    config = dict(ExperimentalFlagsManager.DEFAULT_VALUES, **flags)
+    channel = SimpleNamespace(flag=config.__getitem__, _=lambda s: s)
+    scheduler = SendScheduler(channel)
+    scheduler.BACKOFF_BASE = 0.01
+    return scheduler
+
+
+def test_token_bucket_delays_over_capacity():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert TokenBucket(rate=0, capacity=1).reserve() == 0
+
+
+def test_token_bucket_without_limit_is_penalized():
+    bucket = TokenBucket(rate=0, capacity=1)
+    bucket.penalize(0.5)
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+
+
+def test_send_scheduler_retries_throttled_sends():
+    scheduler = make_scheduler(send_rate_limit=0, send_chat_rate_limit=0)
+    chat = SimpleNamespace(user_name="@chat")
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ResponseError(1205, "")
+        return "sent"
+
+    assert scheduler.submit(chat, send) == "sent"
+    metrics = scheduler.metrics()
+    assert metrics['retried'] == 2
+    assert metrics['sent'] == 1
+    assert metrics['pending'] == 0
+
+
+def test_send_scheduler_waits_before_retrying_without_limits():
+    scheduler = make_scheduler(send_rate_limit=0, send_chat_rate_limit=0)
+    scheduler.BACKOFF_BASE = 0.1
+    chat = SimpleNamespace(user_name="@chat")
+    attempts = []
+
+    def send():
+        attempts.append(time.monotonic())
+        if len(attempts) < 2:
+            raise ResponseError(1205, "")
+        return "sent"
+
+    assert scheduler.submit(chat, send) == "sent"
+    # Backoff of the first retry is 0.1 s with jitter down to half
+    assert attempts[1] - attempts[0] >= 0.05
+
+
+def test_send_scheduler_gives_up_on_other_errors():
+    scheduler = make_scheduler(send_rate_limit=0, send_chat_rate_limit=0)
+    chat = SimpleNamespace(user_name="@chat")
+
+    def send():
+        raise ResponseError(1204, "")
+
+    with pytest.raises(ResponseError):
+        scheduler.submit(chat, send)
+    assert scheduler.metrics()['failed'] == 1
+
+
+def test_send_scheduler_rejects_when_full():
+    scheduler = make_scheduler(send_queue_size=1)
+    chat = SimpleNamespace(user_name="@chat")
+
+    def send():
+        return scheduler.submit(chat, lambda: "inner")
+
+    with pytest.raises(EFBMessageError):
+        scheduler.submit(chat, send)
+    assert scheduler.metrics()['rejected'] == 1
+
+
+def test_throttled_media_is_uploaded_once():
+    from efb_wechat_slave import WeChatChannel
+
+    scheduler = make_scheduler()
+    uploads = []
+    sends = []
+
+    def upload_file(path, file=None, media_type=None):
+        uploads.append((path, file.read(), media_type))
+        return "media-%d" % len(uploads)
+
+    def send_image(path, media_id=None):
+        sends.append(media_id)
+        if len(sends) < 2:
+            raise ResponseError(1205, "")
+        return media_id
+
+    chat = SimpleNamespace(user_name="@chat", bot=SimpleNamespace(upload_file=upload_file))
+    upload = WeChatChannel._upload_once(chat, "photo.jpg", io.BytesIO(b"image"), 'image')
+    assert scheduler.submit(chat, lambda: send_image("photo.jpg", media_id=upload())) == "media-1"
+    assert uploads == [("photo.jpg", b"image", 'image')]
+    assert sends == ["media-1", "media-1"]
@@ -1,6 +1,12 @@
+import queue
+from types import SimpleNamespace
 from xml.etree import ElementTree as ETree
 
 from efb_wechat_slave.slave_message import SlaveMessageManager
+from efb_wechat_slave.vendor.wxpy.api.bot import Bot
+from efb_wechat_slave.vendor.wxpy.api.consts import TEXT, VIDEO
+from efb_wechat_slave.vendor.wxpy.api.messages import MessageConfig, Messages, Registered
+from efb_wechat_slave.vendor.wxpy.utils import ReadStateTracker
 
 
 def test_slave_message_get_node_text():
@@ -18,3 +24,39 @@ def test_slave_message_get_node_text():
     assert SlaveMessageManager.get_node_text(root, "./item/child", "") == "Text"
     assert SlaveMessageManager.get_node_text(root, "./item/non_existing", "fallback") == "fallback"
     assert SlaveMessageManager.get_node_text(root, "./emptyItem", "fallback") == "fallback"
+
+
+class ListeningBot:
+    _listen = Bot._listen
+    _is_ignored = Bot._is_ignored
+    _process_message = Bot._process_message
+
+    def __init__(self):
+        self.self = SimpleNamespace(name="bot", user_name="@self")
+        self.core = SimpleNamespace(msgList=queue.Queue())
+        self.alive = self.is_listening = True
+        self.auto_mark_as_read = False
+        self.metrics = None
+        self.read_state = ReadStateTracker()
+        self.messages = Messages()
+        self.registered = Registered(self)
+        self.ignored_msg_types = set(SlaveMessageManager.IGNORED_MSG_TYPES)
+
+
+def test_ignored_msg_types_keep_videos():
+    bot = ListeningBot()
+    received = []
+
+    def handler(msg):
+        received.append(msg.raw["MsgType"])
+        if msg.type == TEXT:
+            bot.is_listening = False
+
+    bot.registered.append(MessageConfig(bot, handler, chats=None, msg_types=None,
+                                        except_self=False, run_async=False, enabled=True))
+    for msg_id, (msg_type, wxpy_type) in enumerate(((9999, "Useless"), (43, VIDEO), (1, TEXT))):
+        bot.core.msgList.put({"MsgType": msg_type, "Type": wxpy_type, "NewMsgId": msg_id,
+                              "FromUserName": "@friend", "ToUserName": "@self"})
+    bot._listen()
+    # MsgType 43 is produced as a video by itchat, not as a useless message
+    assert received == [43, 1]
@@ -0,0 +1,13 @@
+from efb_wechat_slave import utils as ews_utils
+
+
+def test_wechat_name_unescape_cached():
+    ews_utils.wechat_name_unescape.cache_clear()
+
+    assert ews_utils.wechat_name_unescape("Tom &amp; Jerry[Smile]") == "Tom & Jerry😃"
+    assert ews_utils.wechat_name_unescape("Tom &amp; Jerry[Smile]", False) == "Tom & Jerry[Smile]"
+    assert ews_utils.wechat_name_unescape("Tom &amp; Jerry[Smile]") == "Tom & Jerry😃"
+
+    info = ews_utils.wechat_name_unescape.cache_info()
+    assert info.hits == 1
+    assert info.misses == 2
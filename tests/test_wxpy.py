@@ -0,0 +1,448 @@
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from efb_wechat_slave.vendor.wxpy.api.consts import ATTACHMENT, SHARING, SYSTEM, TEXT, UNSUPPORTED
+from efb_wechat_slave.vendor.wxpy.api.bot import Bot
+from efb_wechat_slave.vendor.itchat.core import Core
+from efb_wechat_slave.vendor.wxpy.api.chats import Chats, Friend, LazyChats, User
+from efb_wechat_slave.vendor.wxpy.api.messages import message as message_module
+from efb_wechat_slave.vendor.wxpy.api.messages import Message, MessageConfig, Messages, Registered, SentMessage
+from efb_wechat_slave.vendor.wxpy.utils import LogSink, MetricsRegistry, PrometheusFileSink, ReadStateTracker, \
+    SingleFlight, enhance_connection, mount_traffic_adapters
+
+SELF = "@self"
+
+
+def test_read_state_skips_chats_already_read():
+    tracker = ReadStateTracker(window=0)
+    marked = []
+
+    def mark():
+        marked.append(1)
+        return "marked"
+
+    assert tracker.request("@friend", mark) == "marked"
+    assert tracker.request("@friend", mark) is None
+    assert len(marked) == 1
+
+    tracker.on_message({"FromUserName": "@friend", "ToUserName": SELF}, SELF)
+    assert tracker.request("@friend", mark) == "marked"
+    assert len(marked) == 2
+
+    # Replied on phone
+    tracker.on_message({"FromUserName": "@friend", "ToUserName": SELF}, SELF)
+    tracker.on_message({"FromUserName": SELF, "ToUserName": "@friend"}, SELF)
+    assert tracker.request("@friend", mark) is None
+    assert len(marked) == 2
+
+
+def test_read_state_coalesces_requests_in_window():
+    tracker = ReadStateTracker(window=0.1)
+    marked = []
+
+    assert tracker.request("@friend", lambda: marked.append(1)) is None
+    for _ in range(3):
+        tracker.on_message({"FromUserName": "@friend", "ToUserName": SELF}, SELF)
+        tracker.request("@friend", lambda: marked.append(1))
+    assert len(marked) == 1
+
+    time.sleep(0.3)
+    assert len(marked) == 2
+    tracker.cancel()
+
+
+def test_metrics_registry_exports_prometheus_text(tmp_path):
+    registry = MetricsRegistry(buckets=(0.01, 0.1))
+    registry.observe("dispatch", 0.005)
+    registry.observe("dispatch", 0.05)
+    registry.inc("messages", type="Text")
+    registry.inc("messages", type="Text")
+    registry.gauge("queue_depth", lambda: 3)
+
+    path = tmp_path / "metrics.prom"
+    PrometheusFileSink(path).export(registry)
+    lines = path.read_text().splitlines()
+    assert 'wechat_dispatch_seconds_bucket{le="0.01"} 1' in lines
+    assert 'wechat_dispatch_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'wechat_dispatch_seconds_count 2' in lines
+    assert 'wechat_messages_total{type="Text"} 2' in lines
+    assert 'wechat_queue_depth 3' in lines
+
+    summary = LogSink().render(registry.collect())
+    assert "dispatch: n=2" in summary
+    assert "messages[Text]=2" in summary
+
+
+def test_traffic_adapters_split_pools_by_endpoint():
+    session = requests.Session()
+    enhance_connection(session)
+    login_info = {"url": "https://wx.qq.com/cgi-bin/mmwebwx-bin",
+                  "fileUrl": "https://file.wx.qq.com/cgi-bin/mmwebwx-bin",
+                  "syncUrl": "https://webpush.wx.qq.com/cgi-bin/mmwebwx-bin"}
+    adapters = mount_traffic_adapters(session, login_info)
+
+    def pool_of(url):
+        return session.get_adapter(url).name
+
+    assert pool_of("https://webpush.wx.qq.com/cgi-bin/mmwebwx-bin/synccheck?r=1") == "poll"
+    assert pool_of("https://wx.qq.com/cgi-bin/mmwebwx-bin/webwxsync?sid=1") == "poll"
+    assert pool_of("https://file.wx.qq.com/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json") == "upload"
+    assert pool_of("https://wx.qq.com/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID=1") == "download"
+    assert pool_of("https://wx.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsg") == "api"
+    assert set(adapters) == {"api", "poll", "upload", "download"}
+    assert adapters["poll"].stats() == {"requests": 0, "in_use": 0, "pool_maxsize": 2}
+    # Only long polling has a default timeout, transfers may take long on slow networks
+    assert adapters["poll"].timeout == (10, 60)
+    assert adapters["api"].timeout is None
+    assert adapters["upload"].timeout is None and adapters["download"].timeout is None
+
+
+class FakeBot:
+    self = SimpleNamespace(name="bot", user_name=SELF)
+
+
+def test_registered_accepts_type():
+    bot = FakeBot()
+    registered = bot.registered = Registered(bot)
+    assert not registered.accepts_type(TEXT)
+
+    def handler(msg):
+        pass
+
+    registered.append(MessageConfig(bot, handler, chats=None, msg_types=None,
+                                    except_self=False, run_async=False, enabled=True))
+    assert registered.accepts_type(TEXT)
+    assert registered.accepts_type(UNSUPPORTED)
+    assert not registered.accepts_type(SYSTEM)
+
+    registered.append(MessageConfig(bot, handler, chats=None, msg_types=SYSTEM,
+                                    except_self=False, run_async=False, enabled=False))
+    assert not registered.accepts_type(SYSTEM)
+    registered.enable()
+    assert registered.accepts_type(SYSTEM)
+
+
+def test_message_resolves_chat_only_when_replying():
+    resolved = []
+
+    class Chat:
+        def send(self, text):
+            return text
+
+    class ChatMessage(Message):
+        @property
+        def chat(self):
+            resolved.append(1)
+            return Chat()
+
+    msg = ChatMessage({"Type": TEXT, "Text": "Hi", "NewMsgId": 1}, FakeBot())
+    assert msg.text == "Hi"
+    assert not resolved
+    assert msg.reply("Hello") == "Hello"
+    assert resolved
+    with pytest.raises(AttributeError):
+        msg.reply_unknown
+
+
+FILE_APPMSG = ("<msg><appmsg appid=\"\" sdkver=\"0\"><title>report &amp; notes.pdf</title><type>6</type>"
+               "<appattach><totallen>1024</totallen><fileext>pdf</fileext></appattach></appmsg>"
+               "<appinfo><version>1</version><appname></appname></appinfo></msg>")
+LINK_APPMSG = ("<msg><appmsg appid=\"wx1\" sdkver=\"0\"><title>Link title</title><type>5</type>"
+               "<url>https://example.com</url></appmsg>"
+               "<appinfo><version>1</version><appname>News App</appname></appinfo></msg>")
+
+
+@pytest.mark.parametrize("raw, file_name, app_name", [
+    ({"Type": ATTACHMENT, "Content": FILE_APPMSG, "FileName": "report &amp;amp; notes.pdf"},
+     "report & notes.pdf", None),
+    ({"Type": SHARING, "Content": LINK_APPMSG, "FileName": "Link"}, "Link title", "News App"),
+    # Not XML, or no title in XML
+    ({"Type": ATTACHMENT, "Content": "<msg><appmsg>", "FileName": "raw.pdf"}, "raw.pdf", None),
+    ({"Type": TEXT, "Content": "plain text"}, None, None),
+    ({"Type": TEXT, "Content": "<msg/>", "FileName": ""}, "", None),
+    ({"Type": TEXT}, None, None),
+])
+def test_message_file_name_and_app_name_from_xml(raw, file_name, app_name):
+    msg = Message(dict(raw), FakeBot())
+    assert msg.file_name == file_name
+    assert msg.app_name == app_name
+
+
+def test_message_parses_content_once(monkeypatch):
+    parsed = []
+    fromstring = message_module.ETree.fromstring
+
+    def counting_fromstring(text):
+        parsed.append(text)
+        return fromstring(text)
+
+    monkeypatch.setattr(message_module.ETree, "fromstring", counting_fromstring)
+    msg = Message({"Type": SHARING, "Content": LINK_APPMSG, "FileName": "Link"}, FakeBot())
+    assert msg.file_name == "Link title"
+    assert msg.app_name == "News App"
+    assert msg.content_xml is msg.content_xml
+    assert len(parsed) == 1
+
+    # Content replaced, e.g. by a handler, is parsed again
+    msg.raw["Content"] = FILE_APPMSG
+    assert msg.file_name == "report & notes.pdf"
+    assert msg.app_name is None
+    assert len(parsed) == 2
+
+    msg.raw["Content"] = "not xml"
+    assert msg.content_xml is None and msg.app_name is None
+    assert len(parsed) == 3
+
+
+def test_registered_routes_by_type_without_resolving_sender():
+    bot = FakeBot()
+    registered = bot.registered = Registered(bot)
+
+    def text(msg):
+        pass
+
+    def own_text(msg):
+        pass
+
+    registered.append(MessageConfig(bot, text, chats=None, msg_types=TEXT,
+                                    except_self=False, run_async=False, enabled=True))
+    registered.append(MessageConfig(bot, own_text, chats=None, msg_types=TEXT,
+                                    except_self=True, run_async=False, enabled=True))
+
+    class UnresolvedMessage(Message):
+        @property
+        def sender(self):
+            raise AssertionError("sender resolved")
+
+    incoming = UnresolvedMessage({"Type": TEXT, "FromUserName": "@friend"}, bot)
+    outgoing = UnresolvedMessage({"Type": TEXT, "FromUserName": SELF}, bot)
+    assert registered.get_config(incoming).func is own_text
+    assert registered.get_config(outgoing).func is text
+    assert registered.get_config(UnresolvedMessage({"Type": SYSTEM}, bot)) is None
+
+    registered.disable(own_text)
+    assert registered.get_config(incoming).func is text
+    registered.pop()
+    registered.disable(text)
+    assert registered.get_config(incoming) is None
+
+
+def test_lazy_chats_wrap_on_access():
+    wrapped = []
+
+    class Chat:
+        def __init__(self, raw):
+            wrapped.append(raw["UserName"])
+            self.raw = raw
+
+        def __eq__(self, other):
+            return self.raw["UserName"] == other.raw["UserName"]
+
+    raws = [{"UserName": "@%d" % i} for i in range(5)]
+    chats = LazyChats(raws, Chat)
+    assert len(chats) == 5 and chats
+    assert not wrapped
+
+    assert chats[3].raw is raws[3]
+    assert chats[3] is chats[3]
+    assert wrapped == ["@3"]
+
+    head = chats[:2] + LazyChats(raws[4:], Chat)
+    assert isinstance(head, LazyChats)
+    assert [c.raw["UserName"] for c in head] == ["@0", "@1", "@4"]
+    assert Chats([Chat(raws[0])]) + chats[2:4] == [Chat(raws[0]), Chat(raws[2]), Chat(raws[3])]
+
+    del wrapped[:]
+    chats.append(Chat({"UserName": "@5"}))
+    assert wrapped == ["@5", "@0", "@1", "@2", "@4"]
+    assert len(chats) == 6 and chats.index(Chat(raws[4])) == 4
+
+
+@pytest.mark.parametrize("operation", [
+    len, bool, list, repr, str, reversed, sorted,
+    lambda c: c[1], lambda c: c[-1], lambda c: list(c[1:3]), lambda c: list(c[::-1]),
+    lambda c: 2 in c, lambda c: 9 in c, lambda c: c.index(2), lambda c: c.count(1), lambda c: c.copy(),
+    lambda c: c + [9], lambda c: [9] + c, lambda c: c * 2, lambda c: 2 * c,
+    lambda c: c == [0, 1, 2, 1], lambda c: c != [0, 1, 2, 1], lambda c: [0, 1, 2, 1] == c,
+    lambda c: c < [0, 1, 3], lambda c: c <= [0, 1, 2, 1], lambda c: c > [0, 1], lambda c: c >= [0, 2],
+    lambda c: [0, 1, 3] > c, lambda c: [0, 2] <= c,
+    lambda c: c == LazyChats([{"n": n} for n in (0, 1, 2, 1)], lambda raw: raw["n"]),
+    lambda c: c < LazyChats([{"n": 5}], lambda raw: raw["n"]),
+])
+def test_lazy_chats_behave_as_list(operation):
+    plain = [0, 1, 2, 1]
+    chats = LazyChats([{"n": n} for n in plain], lambda raw: raw["n"])
+    expected = operation(list(plain))
+    result = operation(chats)
+    if isinstance(expected, list) or hasattr(expected, '__next__'):
+        assert list(result) == list(expected)
+    else:
+        assert result == expected
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    runs = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def refresh():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+
+    refresh_once = SingleFlight(refresh, min_interval=60)
+    results = []
+    leader = threading.Thread(target=lambda: results.append(refresh_once()))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(refresh_once())) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == [True] * 4
+    assert len(runs) == 1
+
+    # Rate limited until forced
+    assert refresh_once() is False
+    assert refresh_once(force=True) is True
+    assert len(runs) == 2
+
+
+def test_single_flight_followers_see_failed_run():
+    started = threading.Event()
+    release = threading.Event()
+
+    def refresh():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("refresh failed")
+
+    refresh_once = SingleFlight(refresh)
+    errors = []
+
+    def lead():
+        try:
+            refresh_once()
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait(5)
+    results = []
+    follower = threading.Thread(target=lambda: results.append(refresh_once()))
+    follower.start()
+    time.sleep(0.2)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 1
+    assert results == [False]
+
+
+def test_messages_ring_buffer_indexes_by_id_and_chat():
+    bot = FakeBot()
+    messages = Messages(max_history=3)
+    received = [Message({"Type": TEXT, "Text": str(i), "NewMsgId": i,
+                         "FromUserName": "@friend" if i % 2 else "@group", "ToUserName": SELF}, bot)
+                for i in range(4)]
+    sent = SentMessage(dict(id=4, text="4", receiver=SimpleNamespace(user_name="@friend")))
+    for msg in received + [sent]:
+        messages.append(msg)
+
+    assert [msg.text for msg in messages] == ["2", "3", "4"]
+    assert messages[0] is received[2] and messages[-1] is sent
+    assert messages.get(1) is None
+    assert messages.get(3) is received[3]
+    assert messages.last("@friend") is sent
+    assert messages.last(SimpleNamespace(user_name="@group")) is received[2]
+    assert list(messages.in_chat("@friend")) == [received[3], sent]
+    assert [msg.text for msg in messages.search("3")] == ["3"]
+
+    messages.max_history = 1
+    assert list(messages) == [sent]
+    assert messages.last("@group") is None
+    messages.max_history = None
+    messages.append(received[0])
+    assert len(messages) == 0
+
+    messages.max_history = 3
+    messages.extend(received[:2])
+    messages.extend(iter(received[2:]))
+    assert list(messages) == received[1:]
+    assert messages.get(0) is None and messages.get(1) is received[1] and messages.last("@friend") is received[3]
+    messages.clear()
+    assert len(messages) == 0 and messages.get(0) is None and messages.last("@friend") is None
+    messages.append(sent)
+    assert list(messages) == [sent]
+
+
+def test_process_message_resolves_no_chat_when_not_logging(caplog):
+    bot = FakeBot()
+    bot.alive = True
+    bot.metrics = None
+    bot.registered = Registered(bot)
+    resolved = []
+
+    class ResolvingMessage(Message):
+        @property
+        def sender(self):
+            resolved.append("sender")
+            return SimpleNamespace(name="friend")
+
+        @property
+        def receiver(self):
+            resolved.append("receiver")
+            return bot.self
+
+    msg = ResolvingMessage({"Type": TEXT, "Text": "Hi", "FromUserName": "@friend"}, bot)
+    caplog.set_level(logging.INFO, logger="efb_wechat_slave.vendor.wxpy")
+    Bot._process_message(bot, msg)
+    assert not resolved
+
+    caplog.set_level(logging.DEBUG, logger="efb_wechat_slave.vendor.wxpy")
+    Bot._process_message(bot, msg)
+    assert resolved
+    assert "friend : Hi" in caplog.text
+
+
+class ContactBot(FakeBot):
+    get_chat_by_user_name = Bot.get_chat_by_user_name
+    _fetch_user = Bot._fetch_user
+
+    def __init__(self, fetched):
+        self.core = Core()
+        self.core.get_contact_info = lambda user_name: [dict(i) for i in fetched if i["UserName"] == user_name]
+        self.core.memberList.append({"UserName": "@friend", "NickName": "friend", "ContactFlag": 3})
+
+
+def test_get_chat_by_user_name_fetches_strangers_without_storing():
+    bot = ContactBot([{"UserName": "@stranger", "NickName": "stranger", "ContactFlag": 0, "VerifyFlag": 0},
+                      {"UserName": "@new", "NickName": "new", "ContactFlag": 3, "VerifyFlag": 0}])
+
+    # Found locally
+    friend = bot.get_chat_by_user_name("@friend", update=True)
+    assert isinstance(friend, Friend) and friend.raw is bot.core.memberList[0]
+
+    # Fetched on its own, and not added to friends
+    stranger = bot.get_chat_by_user_name("@stranger", update=True)
+    assert type(stranger) is User and stranger.nick_name == "stranger"
+    assert bot.get_chat_by_user_name("@stranger") is None
+    assert len(bot.core.memberList) == 1
+
+    # Contacts fetched are kept as friends
+    assert isinstance(bot.get_chat_by_user_name("@new", update=True), Friend)
+    assert bot.core.memberList.get_by_user_name("@new") is not None
+
+    assert bot.get_chat_by_user_name("@missing", update=True) is None
+    assert bot.get_chat_by_user_name("@stranger", update=False) is None